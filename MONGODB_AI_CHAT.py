@@ -140,12 +140,12 @@ class VectorSearchEngine:
             for field_name, field_desc in collection_info['fields'].items():
                 field_text = f"{field_name}: {field_desc}"
                 field_embedding = self.model.encode(field_text)
-                field_embeddings[field_name] = field_embedding.tolist()
+                field_embeddings[field_name] = field_embedding
             
             # Store
             self.embeddings_db[collection_name] = {
                 "description": collection_info['description'],
-                "collection_embedding": collection_embedding.tolist(),
+                "collection_embedding": collection_embedding,
                 "fields": collection_info['fields'],
                 "field_embeddings": field_embeddings,
                 "doc_count": collection_info['doc_count'],
@@ -158,7 +158,9 @@ class VectorSearchEngine:
     def save_embeddings(self, filepath='embeddings.pkl'):
         """Save embeddings to file"""
         with open(filepath, 'wb') as f:
-            pickle.dump(self.embeddings_db, f)
+            # Arrays are pickled as raw ndarray buffers instead of float lists; protocol 5
+            # frames large buffers efficiently (still in-band, no buffer_callback)
+            pickle.dump(self.embeddings_db, f, protocol=5)
         print(f"✓ Embeddings saved to {filepath}")
     
     def load_embeddings(self, filepath='embeddings.pkl'):
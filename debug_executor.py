@@ -1,33 +1,28 @@
 from dynamic_query_executor import executor
+from dynamic_query_generator import query_generator, DateTimeEncoder
 import json
-from bson import json_util
 
-# Test the executor with a simple query
+# Test the executor with a generated query
 question = 'total sales'
-query_str = '[{"$match": {"status": "completed"}}, {"$group": {"_id": null, "total": {"$sum": "$amount"}}}]'
+pipeline, collection_name = query_generator.generate_query(question)
 
 print("Question:", question)
-print("Query string:", query_str)
+print("Pipeline:", pipeline)
 
 try:
-    # Parse the query
-    query_data = json.loads(query_str, object_hook=json_util.object_hook)
-    print("Parsed query:", query_data)
-    
-    # Determine collection
-    collection_name = executor._determine_collection(question, query_str)
     print("Collection determined:", collection_name)
     
-    # Execute directly on collection
+    # Execute directly on collection - the pipeline needs no JSON round trip
     collection = executor.db[collection_name]
-    results = list(collection.aggregate(query_data))
+    results = list(collection.aggregate(pipeline))
     print("Direct aggregation results:", results)
     
-    # Test the full executor method
+    # Test the full executor method, which takes a JSON query string
+    query_str = json.dumps(pipeline, cls=DateTimeEncoder)
     full_result = executor.execute_query(query_str, question)
     print("Full executor result:", full_result)
     
 except Exception as e:
     print("Error:", e)
     import traceback
-    traceback.print_exc()
\ No newline at end of file
+    traceback.print_exc()
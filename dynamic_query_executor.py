@@ -1,8 +1,28 @@
 import json
+import re
 from bson import json_util
 from pymongo import MongoClient
 from metadata_provider import extract_metadata
 
+# orjson is optional; plain-JSON queries decode several times faster with it
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Extended JSON type wrappers that need bson's object_hook to decode
+_EJSON_RE = re.compile(
+    r'"\$(?:date|oid|number(?:Long|Int|Double|Decimal)|binary|regex|regularExpression'
+    r'|timestamp|uuid|code|minKey|maxKey|symbol|dbPointer|undefined)"'
+)
+
+def parse_query(query_str):
+    """Parse a JSON query, running the EJSON object_hook only when needed"""
+    if _EJSON_RE.search(query_str):
+        return json.loads(query_str, object_hook=json_util.object_hook)
+    return _json_loads(query_str)
+
 class DynamicQueryExecutor:
     def __init__(self, connection_string="mongodb://localhost:27017", db_name="ai_test_db"):
         self.client = MongoClient(connection_string)
@@ -18,7 +38,7 @@ class DynamicQueryExecutor:
                 return "Error: Destructive operations are not allowed."
 
             # Parse query
-            query_data = json.loads(query_str, object_hook=json_util.object_hook)
+            query_data = parse_query(query_str)
             
             # Determine collection
             collection_name = self._determine_collection(user_question, query_str)
@@ -1,3 +1,4 @@
+import functools
 import json
 import re
 from datetime import datetime
@@ -9,10 +10,141 @@ class DateTimeEncoder(json.JSONEncoder):
             return {"$date": obj.isoformat() + "Z"}
         return super().default(obj)
 
+def _keyword_regex(keywords):
+    """Compile keywords into one alternation, longest first, tolerating plurals"""
+    ordered = sorted(set(keywords), key=len, reverse=True)
+    return re.compile(r'\b(' + '|'.join(map(re.escape, ordered)) + r')s?\b')
+
+# Intent keywords in priority order; the first intent with a hit wins
+_INTENT_KEYWORDS = {
+    'min_analysis': ('least', 'worst', 'lowest', 'bottom'),
+    'max_analysis': ('most', 'best', 'highest', 'top'),
+    'aggregate_sum': ('total sales', 'total revenue', 'sales total', 'total', 'sum', 'sales', 'revenue'),
+    'count': ('count', 'how many', 'number of'),
+    'average': ('average', 'avg', 'mean'),
+    'list': ('show', 'list', 'display', 'get'),
+    'max': ('max', 'maximum', 'highest'),
+    'min': ('min', 'minimum', 'lowest'),
+}
+_INTENT_PRIORITY = {intent: rank for rank, intent in enumerate(_INTENT_KEYWORDS)}
+_TOKEN_TO_INTENT = {}
+for _intent, _words in _INTENT_KEYWORDS.items():
+    for _word in _words:
+        _TOKEN_TO_INTENT.setdefault(_word, _intent)
+_INTENT_RE = _keyword_regex(_TOKEN_TO_INTENT)
+
+def _matched_intents(question_lower):
+    """Every intent with a keyword in the question"""
+    return frozenset(_TOKEN_TO_INTENT[m.group(1)] for m in _INTENT_RE.finditer(question_lower))
+
+def _top_intent(intents):
+    """Highest-priority intent, defaulting to a plain listing"""
+    if not intents:
+        return 'list'
+    return min(intents, key=_INTENT_PRIORITY.__getitem__)
+
+# Collection hints: which kind of data a question is about
+_HINT_KEYWORDS = {
+    'product': ('product', 'item'),
+    'sales': ('sales', 'revenue', 'income'),
+    'customer': ('customer', 'client'),
+    'metric': ('sales', 'revenue', 'total', 'amount', 'product', 'sold', 'least', 'most'),
+}
+_TOKEN_TO_HINTS = {}
+for _hint, _words in _HINT_KEYWORDS.items():
+    for _word in _words:
+        _TOKEN_TO_HINTS.setdefault(_word, set()).add(_hint)
+_HINT_RE = _keyword_regex(_TOKEN_TO_HINTS)
+
+# Word tokens, matched against lowercased field names
+_WORD_RE = re.compile(r'[a-z0-9_]+')
+
+# Year and status filters, status in priority order
+_STATUS_VALUES = ('completed', 'pending', 'cancelled')
+_FILTER_RE = re.compile(r'(20\d{2})|\b(' + '|'.join(_STATUS_VALUES) + r')\b', re.IGNORECASE)
+
+def _group_key_source(group_id, path):
+    """Map a path on a $group output back to the input field it was grouped by"""
+    if path == '_id':
+        if isinstance(group_id, str) and group_id.startswith('$'):
+            return group_id[1:]
+        return None
+    if not path.startswith('_id.'):
+        return None
+    sub_path = path[len('_id.'):]
+    if isinstance(group_id, str) and group_id.startswith('$'):
+        return f"{group_id[1:]}.{sub_path}"
+    if isinstance(group_id, dict):
+        expr = group_id.get(sub_path)
+        if isinstance(expr, str) and expr.startswith('$'):
+            return expr[1:]
+    return None
+
+def _hoist_group_key_matches(pipeline):
+    """Move $match predicates on a $group key above the $group.
+    
+    A filter on the group key selects exactly the input documents that would
+    form those groups, so it can run before grouping and shrink the input.
+    Predicates on accumulated fields stay after the $group.
+    """
+    pipeline = list(pipeline)
+    i = 1
+    while i < len(pipeline):
+        stage, prev = pipeline[i], pipeline[i - 1]
+        if '$match' not in stage or '$group' not in prev:
+            i += 1
+            continue
+        
+        group_id = prev['$group'].get('_id')
+        hoisted, kept = {}, {}
+        for path, condition in stage['$match'].items():
+            source = _group_key_source(group_id, path)
+            if source:
+                hoisted[source] = condition
+            else:
+                kept[path] = condition
+        
+        if not hoisted:
+            i += 1
+            continue
+        
+        if kept:
+            pipeline[i] = {"$match": kept}
+        else:
+            del pipeline[i]
+        
+        before = pipeline[i - 2] if i >= 2 else None
+        if before and '$match' in before and not hoisted.keys() & before['$match'].keys():
+            pipeline[i - 2] = {"$match": {**before['$match'], **hoisted}}
+        else:
+            pipeline.insert(i - 1, {"$match": hoisted})
+            i += 1
+        i += 1
+    return pipeline
+
 class DynamicQueryGenerator:
     def __init__(self):
+        self.metadata_version = 0
+        self._load_metadata()
+    
+    def refresh_metadata(self):
+        """Re-read the database schema after it changes"""
+        self._load_metadata()
+        # Invalidates generate_mongo_query's cached results for the old schema
+        self.metadata_version += 1
+    
+    def _load_metadata(self):
+        """Read the schema and rebuild everything derived from it"""
         self.metadata = extract_metadata()
         self.collections = list(self.metadata.keys())
+        self._collection_set = frozenset(self.collections)
+        self._collections_lower = {c.lower(): c for c in self.collections}
+        # Zero-width lookahead so mentions overlapping in the question all match
+        names = sorted(self._collections_lower, key=len, reverse=True)
+        self._collection_re = re.compile(
+            '(?=(' + '|'.join(map(re.escape, names)) + '))'
+        ) if names else None
+        self._index_metadata()
         
     def analyze_question(self, question):
         """Analyze user question to determine intent and relevant collections"""
@@ -21,121 +153,91 @@ class DynamicQueryGenerator:
         # Find mentioned collections or related terms
         relevant_collections = []
         
+        hints = frozenset(hint for m in _HINT_RE.finditer(question_lower)
+                          for hint in _TOKEN_TO_HINTS[m.group(1)])
+        
         # Product queries should analyze orders with product joins
-        if any(word in question_lower for word in ['product', 'products', 'item', 'items']):
-            if 'orders' in self.collections:
+        if 'product' in hints:
+            if 'orders' in self._collection_set:
                 relevant_collections.append('orders')
         
         # Sales/revenue queries should target orders collection
-        elif any(word in question_lower for word in ['sales', 'revenue', 'total sales', 'income']):
-            if 'orders' in self.collections:
+        elif 'sales' in hints:
+            if 'orders' in self._collection_set:
                 relevant_collections.append('orders')
         
         # Customer queries should target customers collection
-        elif any(word in question_lower for word in ['customer', 'customers', 'client', 'clients']):
-            if 'customers' in self.collections:
+        elif 'customer' in hints:
+            if 'customers' in self._collection_set:
                 relevant_collections.append('customers')
         
         # Direct collection mentions
-        for collection in self.collections:
-            if collection.lower() in question_lower:
-                relevant_collections.append(collection)
+        if self._collection_re:
+            mentioned = {m.group(1) for m in self._collection_re.finditer(question_lower)}
+            relevant_collections.extend(
+                orig for lower, orig in self._collections_lower.items() if lower in mentioned
+            )
         
         # If no direct collection match, look for field names
         if not relevant_collections:
-            for collection, info in self.metadata.items():
-                fields = info.get('fields', {})
-                for field in fields.keys():
-                    if field.lower() in question_lower:
-                        relevant_collections.append(collection)
-                        break
+            matched = set()
+            for token in _WORD_RE.findall(question_lower):
+                matched.update(self._field_to_colls.get(token, ()))
+                if token.endswith('s'):
+                    matched.update(self._field_to_colls.get(token[:-1], ()))
+            relevant_collections.extend(c for c in self.collections if c in matched)
         
         # For sales/revenue/product queries, default to orders
         if not relevant_collections:
-            if any(word in question_lower for word in ['sales', 'revenue', 'total', 'amount', 'product', 'sold', 'least', 'most']):
+            if 'metric' in hints:
                 relevant_collections = ['orders']
             else:
                 relevant_collections = [self.collections[0]] if self.collections else ['orders']
             
         return {
             'collections': relevant_collections,
-            'intent': self._determine_intent(question_lower),
-            'filters': self._extract_filters(question)
+            'intent': _top_intent(_matched_intents(question_lower)),
+            'filters': self._extract_filters(question),
+            'hints': hints
         }
     
-    def _determine_intent(self, question):
-        """Determine what the user wants to do"""
-        if any(word in question for word in ['least', 'worst', 'lowest', 'bottom']):
-            return 'min_analysis'
-        elif any(word in question for word in ['most', 'best', 'highest', 'top']):
-            return 'max_analysis'
-        elif any(word in question for word in ['total sales', 'total revenue', 'sales total']):
-            return 'aggregate_sum'
-        elif any(word in question for word in ['total', 'sum', 'sales', 'revenue']):
-            return 'aggregate_sum'
-        elif any(word in question for word in ['count', 'how many', 'number of']):
-            return 'count'
-        elif any(word in question for word in ['average', 'avg', 'mean']):
-            return 'average'
-        elif any(word in question for word in ['show', 'list', 'display', 'get']):
-            return 'list'
-        elif any(word in question for word in ['max', 'maximum', 'highest']):
-            return 'max'
-        elif any(word in question for word in ['min', 'minimum', 'lowest']):
-            return 'min'
-        else:
-            return 'list'
-    
     def _extract_filters(self, question):
         """Extract date ranges, status filters, etc."""
         filters = {}
         
-        # Extract year
-        year_match = re.search(r'20\d{2}', question)
-        if year_match:
-            year = year_match.group()
-            filters['year'] = year
-            
+        statuses = set()
+        for m in _FILTER_RE.finditer(question):
+            year, status = m.groups()
+            if year:
+                # Only the first year mentioned is used
+                filters.setdefault('year', year)
+            else:
+                statuses.add(status.lower())
+        
         # Extract status mentions
-        if 'completed' in question.lower():
-            filters['status'] = 'completed'
-        elif 'pending' in question.lower():
-            filters['status'] = 'pending'
-        elif 'cancelled' in question.lower():
-            filters['status'] = 'cancelled'
+        for status in _STATUS_VALUES:
+            if status in statuses:
+                filters['status'] = status
+                break
             
         return filters
     
     def generate_query(self, question):
-        """Generate MongoDB query based on question analysis"""
+        """Generate a MongoDB aggregation pipeline based on question analysis
+        
+        Returns (pipeline, collection) with the pipeline as a list of stage
+        dicts, ready to hand to collection.aggregate().
+        """
         analysis = self.analyze_question(question)
         collection = analysis['collections'][0]
         intent = analysis['intent']
         filters = analysis['filters']
+        hints = analysis['hints']
         
-        # Build match stage
-        match_stage = {}
+        match_stage = self._build_match_stage(collection, filters, intent, hints)
         
-        # Add date filter if year specified
-        if 'year' in filters:
-            year = int(filters['year'])
-            date_fields = self._find_date_fields(collection)
-            if date_fields:
-                date_field = date_fields[0]
-                from datetime import datetime
-                match_stage[date_field] = {
-                    "$gte": datetime(year, 1, 1),
-                    "$lt": datetime(year + 1, 1, 1)
-                }
-        
-        # Add status filter if specified or if it's a sales query
-        if 'status' in filters and self._has_field(collection, 'status'):
-            match_stage['status'] = filters['status']
-        elif intent == 'aggregate_sum' and self._has_field(collection, 'status'):
-            # For sales queries, default to completed orders
-            match_stage['status'] = 'completed'
-        
-        # Build pipeline based on intent
+        # Build pipeline based on intent; the $match always leads so the
+        # server can use indexes before any $group/$lookup work
         pipeline = []
         
         if match_stage:
@@ -166,136 +268,182 @@ class DynamicQueryGenerator:
                     }
                 })
                 
-        elif intent == 'min_analysis':
-            # For product analysis queries like "which product sold least"
-            if any(word in question.lower() for word in ['product', 'item']):
-                pipeline.extend([
-                    {
-                        "$group": {
-                            "_id": "$productId",
-                            "totalSales": {"$sum": "$amount"},
-                            "quantitySold": {"$sum": "$quantity"}
-                        }
-                    },
-                    {
-                        "$lookup": {
-                            "from": "products",
-                            "localField": "_id",
-                            "foreignField": "_id",
-                            "as": "product"
-                        }
-                    },
-                    {"$unwind": "$product"},
-                    {
-                        "$project": {
-                            "productName": "$product.name",
-                            "totalSales": 1,
-                            "quantitySold": 1
-                        }
-                    },
-                    {"$sort": {"totalSales": 1}},  # Ascending for least
-                    {"$limit": 10}
-                ])
-            else:
-                amount_field = self._find_amount_field(collection)
-                if amount_field:
-                    pipeline.append({
-                        "$group": {
-                            "_id": None,
-                            "min": {"$min": f"${amount_field}"}
-                        }
-                    })
-                    
-        elif intent == 'max_analysis':
-            # For product analysis queries like "which product sold most"
-            if any(word in question.lower() for word in ['product', 'item']):
-                pipeline.extend([
-                    {
-                        "$group": {
-                            "_id": "$productId",
-                            "totalSales": {"$sum": "$amount"},
-                            "quantitySold": {"$sum": "$quantity"}
-                        }
-                    },
-                    {
-                        "$lookup": {
-                            "from": "products",
-                            "localField": "_id",
-                            "foreignField": "_id",
-                            "as": "product"
-                        }
-                    },
-                    {"$unwind": "$product"},
-                    {
-                        "$project": {
-                            "productName": "$product.name",
-                            "totalSales": 1,
-                            "quantitySold": 1
-                        }
-                    },
-                    {"$sort": {"totalSales": -1}},  # Descending for most
-                    {"$limit": 10}
-                ])
+        elif intent in ('min_analysis', 'max_analysis'):
+            # For product analysis queries like "which product sold least/most"
+            if 'product' in hints:
+                sort_order = 1 if intent == 'min_analysis' else -1
+                pipeline.extend(self._product_sales_stages(sort_order))
             else:
                 amount_field = self._find_amount_field(collection)
                 if amount_field:
+                    op = 'min' if intent == 'min_analysis' else 'max'
                     pipeline.append({
                         "$group": {
                             "_id": None,
-                            "max": {"$max": f"${amount_field}"}
+                            op: {f"${op}": f"${amount_field}"}
                         }
                     })
                 
         else:  # list intent
+            sort_field = self._primary_date.get(collection, "_id")
             pipeline.extend([
-                {"$sort": {self._find_date_fields(collection)[0]: -1}} if self._find_date_fields(collection) else {"$sort": {"_id": -1}},
+                {"$sort": {sort_field: -1}},
                 {"$limit": 10}
             ])
         
-        return json.dumps(pipeline, cls=DateTimeEncoder), collection
+        return _hoist_group_key_matches(pipeline), collection
     
-    def _find_amount_field(self, collection):
-        """Find fields that likely contain monetary amounts"""
-        if collection not in self.metadata:
-            return None
-            
-        fields = self.metadata[collection].get('fields', {})
-        amount_candidates = ['amount', 'total', 'price', 'cost', 'value', 'revenue', 'sales']
+    def generate_bidirectional_product_query(self, question):
+        """Best and worst selling products from a single $group/$lookup pass
         
-        for candidate in amount_candidates:
-            for field_name in fields.keys():
-                if candidate in field_name.lower():
-                    return field_name
-        return None
+        Returns (pipeline, collection); the pipeline yields one document with
+        'top' and 'bottom' lists of up to 10 products each.
+        """
+        analysis = self.analyze_question(question)
+        collection = 'orders'
+        hints = analysis['hints'] | {'product'}
+        match_stage = self._build_match_stage(collection, analysis['filters'], 'max_analysis', hints)
+        
+        pipeline = [{"$match": match_stage}] if match_stage else []
+        pipeline.extend(self._product_sales_stages(None))
+        return _hoist_group_key_matches(pipeline), collection
     
-    def _find_date_fields(self, collection):
-        """Find fields that contain dates"""
-        if collection not in self.metadata:
-            return []
-            
-        fields = self.metadata[collection].get('fields', {})
-        date_fields = []
+    def _build_match_stage(self, collection, filters, intent, hints):
+        """Build the leading $match from the question's filters"""
+        match_stage = {}
         
-        for field_name, field_type in fields.items():
-            if field_type == 'date' or 'date' in field_name.lower() or 'time' in field_name.lower():
-                date_fields.append(field_name)
-                
-        return date_fields
+        # Add date filter if year specified
+        if 'year' in filters:
+            year = int(filters['year'])
+            date_field = self._primary_date.get(collection)
+            if date_field:
+                match_stage[date_field] = {
+                    "$gte": datetime(year, 1, 1),
+                    "$lt": datetime(year + 1, 1, 1)
+                }
+        
+        # Add status filter if specified or if it's a sales query
+        if 'status' in filters and self._has_field(collection, 'status'):
+            match_stage['status'] = filters['status']
+        elif self._is_sales_intent(intent, hints) and self._has_field(collection, 'status'):
+            # For sales queries, default to completed orders
+            match_stage['status'] = 'completed'
+        
+        return match_stage
+    
+    def _is_sales_intent(self, intent, hints):
+        """Sales totals and product sales rankings only count completed orders"""
+        if intent == 'aggregate_sum':
+            return True
+        return (intent in ('min_analysis', 'max_analysis')
+                and 'product' in hints)
+    
+    def _product_sales_stages(self, sort_order):
+        """Per-product sales ranking, ascending (1) or descending (-1)
+        
+        With sort_order None both rankings are built from the same grouped
+        documents in a $facet with 'top' and 'bottom' legs. Each ranking is
+        cut to 10 before joining products, so only displayed rows are looked up.
+        """
+        stages = [
+            {
+                "$group": {
+                    "_id": "$productId",
+                    "totalSales": {"$sum": "$amount"},
+                    "quantitySold": {"$sum": "$quantity"}
+                }
+            },
+            # Orders without a product never join; hoisted above $group below
+            {"$match": {"_id": {"$ne": None}}}
+        ]
+        
+        if sort_order is None:
+            stages.append({
+                "$facet": {
+                    "top": self._ranked_product_stages(-1),
+                    "bottom": self._ranked_product_stages(1)
+                }
+            })
+        else:
+            stages.extend(self._ranked_product_stages(sort_order))
+        return stages
+    
+    def _ranked_product_stages(self, sort_order):
+        """Sort and limit grouped product sales, then join product names"""
+        return [
+            {"$sort": {"totalSales": sort_order}},
+            {"$limit": 10},
+            # Only the product name is needed, so project it inside the join
+            {
+                "$lookup": {
+                    "from": "products",
+                    "let": {"pid": "$_id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$_id", "$$pid"]}}},
+                        {"$project": {"name": 1}}
+                    ],
+                    "as": "product"
+                }
+            },
+            {"$unwind": "$product"},
+            {
+                "$project": {
+                    "productName": "$product.name",
+                    "totalSales": 1,
+                    "quantitySold": 1
+                }
+            }
+        ]
+    
+    def _index_metadata(self):
+        """Precompute per-collection field lookups used on every query"""
+        amount_candidates = ['amount', 'total', 'price', 'cost', 'value', 'revenue', 'sales']
+        self._amount_field = {}
+        self._primary_date = {}
+        self._field_set = {}
+        self._field_to_colls = {}
+        
+        for collection, info in self.metadata.items():
+            fields = info.get('fields', {})
+            self._field_set[collection] = frozenset(fields)
+            for field_name in fields:
+                self._field_to_colls.setdefault(field_name.lower(), []).append(collection)
+            
+            self._amount_field[collection] = next(
+                (field_name for candidate in amount_candidates
+                 for field_name in fields if candidate in field_name.lower()),
+                None
+            )
+            
+            date_field = next(
+                (field_name for field_name, field_type in fields.items()
+                 if field_type == 'date' or 'date' in field_name.lower() or 'time' in field_name.lower()),
+                None
+            )
+            if date_field:
+                self._primary_date[collection] = date_field
+    
+    def _find_amount_field(self, collection):
+        """Find fields that likely contain monetary amounts"""
+        return self._amount_field.get(collection)
     
     def _has_field(self, collection, field_name):
         """Check if collection has a specific field"""
-        if collection not in self.metadata:
-            return False
-        return field_name in self.metadata[collection].get('fields', {})
+        return field_name in self._field_set.get(collection, ())
 
 # Global instance
 query_generator = DynamicQueryGenerator()
 
+@functools.lru_cache(maxsize=256)
+def _generate_cached(question: str, metadata_version: int) -> str:
+    """Serialized pipeline for a question against one schema snapshot"""
+    pipeline, _ = query_generator.generate_query(question)
+    return json.dumps(pipeline, cls=DateTimeEncoder)
+
 def generate_mongo_query(prompt: str) -> str:
     """Dynamic query generation that adapts to any database schema"""
     try:
-        query, collection = query_generator.generate_query(prompt)
-        return query
+        return _generate_cached(prompt, query_generator.metadata_version)
     except Exception as e:
         # Fallback to simple query
         return json.dumps([{"$limit": 10}], cls=DateTimeEncoder)
\ No newline at end of file
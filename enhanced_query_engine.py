@@ -129,7 +129,8 @@ class EnhancedQueryEngine(DynamicQueryGenerator):
         
         else:
             # Use the parent class method with enhancements
-            return super().generate_query(enhanced_question)
+            pipeline, collection = super().generate_query(enhanced_question)
+            return json.dumps(pipeline, cls=DateTimeEncoder), collection
     
     def _generate_churn_query(self):
         """Generate churn analysis query"""
@@ -3,6 +3,24 @@
 Enhanced Response Formatter - Better business context formatting
 """
 
+from datetime import datetime
+
+# Pre-bound number formats for the per-row loops
+_MONEY = "${:,.2f}".format
+_INT = "{:,}".format
+
+def _sales_stats(sales_values):
+    """Return (total, best_index, worst_index) for a list of sales figures"""
+    total = 0
+    best_idx = worst_idx = 0
+    for i, value in enumerate(sales_values):
+        total += value
+        if value > sales_values[best_idx]:
+            best_idx = i
+        if value < sales_values[worst_idx]:
+            worst_idx = i
+    return total, best_idx, worst_idx
+
 class EnhancedResponseFormatter:
     def __init__(self):
         pass
@@ -15,162 +33,175 @@ class EnhancedResponseFormatter:
             return f"❌ **Error:** {raw_data}\n\n💡 Try: 'total sales', 'top customers', or 'recent orders'"
         
         if not isinstance(raw_data, list) or len(raw_data) == 0:
-            return self._format_no_data_response(question)
+            return self._format_no_data_response(question_lower)
         
-        # Detect response type
+        # Detect response type from the first row's keys
         first_item = raw_data[0]
+        keys = set(first_item) if isinstance(first_item, dict) else set()
+        
+        # Best and worst products from one $facet query
+        if keys == {'top', 'bottom'}:
+            return self._format_product_extremes(first_item, question_lower)
         
         # Churn analysis
-        if 'customerName' in str(first_item) and 'lastOrderDate' in str(first_item):
+        if 'customerName' in keys and 'lastOrderDate' in keys:
             return self._format_churn_analysis(raw_data)
         
         # Seasonal analysis
-        if 'monthName' in str(first_item) and 'totalSales' in str(first_item):
+        if 'monthName' in keys and 'totalSales' in keys:
             return self._format_seasonal_analysis(raw_data)
         
         # Product performance
-        if 'productName' in str(first_item) and 'totalSales' in str(first_item):
-            return self._format_product_performance(raw_data, question)
+        if 'productName' in keys and 'totalSales' in keys:
+            worst = any(word in question_lower for word in ['worst', 'least', 'bottom', 'lowest'])
+            return self._format_product_performance(raw_data, worst)
         
         # Customer performance
-        if 'customerName' in str(first_item) and 'totalSpent' in str(first_item):
-            return self._format_customer_performance(raw_data, question)
+        if 'customerName' in keys and 'totalSpent' in keys:
+            return self._format_customer_performance(raw_data, question_lower)
         
         # City analysis
-        if 'city' in str(first_item) and 'totalSales' in str(first_item):
+        if 'city' in keys and 'totalSales' in keys:
             return self._format_city_analysis(raw_data)
         
         # Sales summary
-        if isinstance(first_item, dict) and len(first_item) <= 3 and 'totalSales' in str(first_item):
-            return self._format_sales_summary(raw_data, question)
+        if isinstance(first_item, dict) and len(first_item) <= 3 and 'totalSales' in keys:
+            return self._format_sales_summary(raw_data, question_lower)
         
         # Count results
         if isinstance(first_item, dict) and 'total' in first_item and len(first_item) == 1:
-            return self._format_count_result(raw_data, question)
+            return self._format_count_result(raw_data, question_lower)
         
         # Aggregation results
         if isinstance(first_item, dict) and '_id' in first_item and len(first_item) == 2:
-            return self._format_aggregation_result(raw_data, question)
+            return self._format_aggregation_result(raw_data, question_lower)
         
         # Generic list
-        return self._format_generic_list(raw_data, question)
+        return self._format_generic_list(raw_data, question_lower)
     
     def _format_churn_analysis(self, data):
         """Format churn analysis results"""
-        response = f"🚨 **Customer Churn Analysis**\n\n"
-        response += f"Found **{len(data)}** customers who haven't ordered recently:\n\n"
+        parts = [f"🚨 **Customer Churn Analysis**\n\n"]
+        parts.append(f"Found **{len(data)}** customers who haven't ordered recently:\n\n")
         
+        now = datetime.now()
         for i, customer in enumerate(data[:10], 1):
-            name = customer.get('customerName', 'Unknown')
-            last_order = customer.get('lastOrderDate', 'Unknown')
-            total_spent = customer.get('totalSpent', 0)
-            orders = customer.get('totalOrders', 0)
+            get = customer.get
+            name = get('customerName', 'Unknown')
+            last_order = get('lastOrderDate', 'Unknown')
+            total_spent = get('totalSpent', 0)
+            orders = get('totalOrders', 0)
             
             # Calculate days since last order
             if isinstance(last_order, str):
                 days_ago = "90+ days"
             else:
-                from datetime import datetime
-                days = (datetime.now() - last_order).days
+                days = (now - last_order).days
                 days_ago = f"{days} days"
             
-            response += f"{i}. **{name}** - Last order: {days_ago} ago\n"
-            response += f"   💰 Total spent: ${total_spent:,.2f} ({orders} orders)\n\n"
+            parts.append(f"{i}. **{name}** - Last order: {days_ago} ago\n")
+            parts.append(f"   💰 Total spent: {_MONEY(total_spent)} ({orders} orders)\n\n")
         
-        response += "💡 **Recommendation:** Consider reaching out with personalized offers to re-engage these customers."
-        return response
+        parts.append("💡 **Recommendation:** Consider reaching out with personalized offers to re-engage these customers.")
+        return ''.join(parts)
     
     def _format_seasonal_analysis(self, data):
         """Format seasonal analysis results"""
-        response = "📅 **Seasonal Sales Analysis**\n\n"
+        parts = ["📅 **Seasonal Sales Analysis**\n\n"]
         
-        total_sales = sum(item.get('totalSales', 0) for item in data)
+        sales_values = [item.get('totalSales', 0) for item in data]
+        total_sales, best_idx, worst_idx = _sales_stats(sales_values)
         
-        for item in data:
+        for item, sales in zip(data, sales_values):
             month = item.get('monthName', 'Unknown')
-            sales = item.get('totalSales', 0)
             orders = item.get('orderCount', 0)
             
             percentage = (sales / total_sales * 100) if total_sales > 0 else 0
             
-            response += f"📊 **{month}:** ${sales:,.2f} ({percentage:.1f}% of total, {orders:,} orders)\n"
+            parts.append(f"📊 **{month}:** {_MONEY(sales)} ({percentage:.1f}% of total, {_INT(orders)} orders)\n")
         
-        # Find best and worst months
+        # Best and worst months
         if len(data) > 1:
-            best_month = max(data, key=lambda x: x.get('totalSales', 0))
-            worst_month = min(data, key=lambda x: x.get('totalSales', 0))
-            
-            response += f"\n🏆 **Best month:** {best_month.get('monthName')} (${best_month.get('totalSales', 0):,.2f})\n"
-            response += f"📉 **Slowest month:** {worst_month.get('monthName')} (${worst_month.get('totalSales', 0):,.2f})"
+            parts.append(f"\n🏆 **Best month:** {data[best_idx].get('monthName')} (${sales_values[best_idx]:,.2f})\n")
+            parts.append(f"📉 **Slowest month:** {data[worst_idx].get('monthName')} (${sales_values[worst_idx]:,.2f})")
         
-        return response
+        return ''.join(parts)
     
-    def _format_product_performance(self, data, question):
-        """Format product performance results"""
-        question_lower = question.lower()
-        
-        if any(word in question_lower for word in ['worst', 'least', 'bottom', 'lowest']):
-            response = "📉 **Worst Performing Products**\n\n"
+    def _format_product_performance(self, data, worst):
+        """Format product performance results, ranked worst-first when worst is set"""
+        if worst:
+            parts = ["📉 **Worst Performing Products**\n\n"]
         else:
-            response = "📈 **Top Performing Products**\n\n"
+            parts = ["📈 **Top Performing Products**\n\n"]
         
         for i, item in enumerate(data[:10], 1):
-            name = item.get('productName', 'Unknown')
-            sales = item.get('totalSales', 0)
-            quantity = item.get('quantitySold', 0)
-            orders = item.get('orderCount', 0)
+            get = item.get
+            name = get('productName', 'Unknown')
+            sales = get('totalSales', 0)
+            quantity = get('quantitySold', 0)
+            orders = get('orderCount', 0)
             
-            response += f"{i}. **{name}**\n"
-            response += f"   💰 Sales: ${sales:,.2f} | 📦 Units: {quantity:,} | 🛒 Orders: {orders:,}\n\n"
+            parts.append(f"{i}. **{name}**\n")
+            parts.append(f"   💰 Sales: {_MONEY(sales)} | 📦 Units: {_INT(quantity)} | 🛒 Orders: {_INT(orders)}\n\n")
         
-        return response
+        return ''.join(parts)
     
-    def _format_customer_performance(self, data, question):
+    def _format_product_extremes(self, facets, question_lower):
+        """Format paired best/worst product rankings"""
+        top = facets.get('top') or []
+        bottom = facets.get('bottom') or []
+        if not top and not bottom:
+            return self._format_no_data_response(question_lower)
+        
+        return ''.join([
+            self._format_product_performance(top, worst=False),
+            self._format_product_performance(bottom, worst=True)
+        ])
+    
+    def _format_customer_performance(self, data, question_lower):
         """Format customer performance results"""
-        question_lower = question.lower()
-        
         if any(word in question_lower for word in ['worst', 'least', 'bottom', 'lowest']):
-            response = "📉 **Lowest Value Customers**\n\n"
+            parts = ["📉 **Lowest Value Customers**\n\n"]
         else:
-            response = "👑 **Top Value Customers**\n\n"
+            parts = ["👑 **Top Value Customers**\n\n"]
         
         for i, item in enumerate(data[:10], 1):
-            name = item.get('customerName', 'Unknown')
-            spent = item.get('totalSpent', 0)
-            orders = item.get('orderCount', 0)
-            avg_order = item.get('avgOrderValue', 0)
-            city = item.get('customerCity', 'Unknown')
+            get = item.get
+            name = get('customerName', 'Unknown')
+            spent = get('totalSpent', 0)
+            orders = get('orderCount', 0)
+            avg_order = get('avgOrderValue', 0)
+            city = get('customerCity', 'Unknown')
             
-            response += f"{i}. **{name}** ({city})\n"
-            response += f"   💰 Spent: ${spent:,.2f} | 🛒 Orders: {orders} | 📊 Avg: ${avg_order:.2f}\n\n"
+            parts.append(f"{i}. **{name}** ({city})\n")
+            parts.append(f"   💰 Spent: {_MONEY(spent)} | 🛒 Orders: {orders} | 📊 Avg: ${avg_order:.2f}\n\n")
         
-        return response
+        return ''.join(parts)
     
     def _format_city_analysis(self, data):
         """Format city analysis results"""
-        response = "🗺️ **Sales by Location**\n\n"
+        parts = ["🗺️ **Sales by Location**\n\n"]
         
-        total_sales = sum(item.get('totalSales', 0) for item in data)
+        sales_values = [item.get('totalSales', 0) for item in data]
+        total_sales, _, _ = _sales_stats(sales_values)
         
-        for i, item in enumerate(data, 1):
+        for i, (item, sales) in enumerate(zip(data, sales_values), 1):
             city = item.get('city', item.get('_id', 'Unknown'))
-            sales = item.get('totalSales', 0)
             orders = item.get('orderCount', 0)
             customers = item.get('customerCount', 0)
             
             percentage = (sales / total_sales * 100) if total_sales > 0 else 0
             
-            response += f"{i}. **{city}** - ${sales:,.2f} ({percentage:.1f}%)\n"
-            response += f"   🛒 {orders:,} orders"
+            parts.append(f"{i}. **{city}** - {_MONEY(sales)} ({percentage:.1f}%)\n")
+            parts.append(f"   🛒 {_INT(orders)} orders")
             if customers > 0:
-                response += f" | 👥 {customers:,} customers"
-            response += "\n\n"
+                parts.append(f" | 👥 {_INT(customers)} customers")
+            parts.append("\n\n")
         
-        return response
+        return ''.join(parts)
     
-    def _format_sales_summary(self, data, question):
+    def _format_sales_summary(self, data, question_lower):
         """Format sales summary"""
-        question_lower = question.lower()
         first_item = data[0]
         
         total_sales = first_item.get('totalSales', first_item.get('total', 0))
@@ -183,25 +214,24 @@ class EnhancedResponseFormatter:
         elif 'last year' in question_lower or '2023' in question_lower:
             time_context = " for 2023"
         
-        response = f"💰 **Sales Summary{time_context}**\n\n"
-        response += f"**Total Revenue:** ${total_sales:,.2f}\n"
+        parts = [f"💰 **Sales Summary{time_context}**\n\n"]
+        parts.append(f"**Total Revenue:** ${total_sales:,.2f}\n")
         
         if order_count > 0:
             avg_order_value = total_sales / order_count
-            response += f"**Total Orders:** {order_count:,}\n"
-            response += f"**Average Order Value:** ${avg_order_value:.2f}\n"
+            parts.append(f"**Total Orders:** {order_count:,}\n")
+            parts.append(f"**Average Order Value:** ${avg_order_value:.2f}\n")
         
         # Add business insights
         if total_sales > 1000000:
-            response += f"\n🎉 Excellent performance! Revenue exceeded $1M{time_context}."
+            parts.append(f"\n🎉 Excellent performance! Revenue exceeded $1M{time_context}.")
         elif total_sales > 500000:
-            response += f"\n👍 Good performance! Strong revenue{time_context}."
+            parts.append(f"\n👍 Good performance! Strong revenue{time_context}.")
         
-        return response
+        return ''.join(parts)
     
-    def _format_count_result(self, data, question):
+    def _format_count_result(self, data, question_lower):
         """Format count results"""
-        question_lower = question.lower()
         count = data[0].get('total', 0)
         
         if 'customer' in question_lower:
@@ -213,9 +243,8 @@ class EnhancedResponseFormatter:
         else:
             return f"📊 **Total Count:** {count:,} records found"
     
-    def _format_aggregation_result(self, data, question):
+    def _format_aggregation_result(self, data, question_lower):
         """Format aggregation results"""
-        question_lower = question.lower()
         first_item = data[0]
         
         for key, value in first_item.items():
@@ -229,47 +258,47 @@ class EnhancedResponseFormatter:
         
         return f"📊 **Result:** {first_item}"
     
-    def _format_generic_list(self, data, question):
+    def _format_generic_list(self, data, question_lower):
         """Format generic list results"""
-        response = "📋 **Results:**\n\n"
+        parts = ["📋 **Results:**\n\n"]
         
         for i, item in enumerate(data[:10], 1):
             if isinstance(item, dict):
                 if 'name' in item:
-                    response += f"{i}. **{item['name']}**"
+                    parts.append(f"{i}. **{item['name']}**")
                     if 'email' in item:
-                        response += f" - {item['email']}"
+                        parts.append(f" - {item['email']}")
                     if 'city' in item:
-                        response += f" ({item['city']})"
+                        parts.append(f" ({item['city']})")
                     if 'price' in item:
-                        response += f" - ${item['price']}"
-                    response += "\n"
+                        parts.append(f" - ${item['price']}")
+                    parts.append("\n")
                 else:
                     fields = [f"{k}: {v}" for k, v in item.items() if k != '_id'][:3]
-                    response += f"{i}. {' | '.join(fields)}\n"
+                    parts.append(f"{i}. {' | '.join(fields)}\n")
             else:
-                response += f"{i}. {item}\n"
+                parts.append(f"{i}. {item}\n")
         
         if len(data) > 10:
-            response += f"\n... and {len(data) - 10} more results"
+            parts.append(f"\n... and {len(data) - 10} more results")
         
-        return response
+        return ''.join(parts)
     
-    def _format_no_data_response(self, question):
+    def _format_no_data_response(self, question_lower):
         """Format no data response with suggestions"""
-        response = "🔍 **No data found for your query.**\n\n"
-        response += "💡 **Try these alternatives:**\n"
-        
-        if 'sales' in question.lower():
-            response += "• 'total sales this year'\n• 'sales by city'\n• 'monthly sales trends'"
-        elif 'customer' in question.lower():
-            response += "• 'all customers'\n• 'top customers by spending'\n• 'customers by city'"
-        elif 'product' in question.lower():
-            response += "• 'all products'\n• 'top selling products'\n• 'worst performing products'"
+        parts = ["🔍 **No data found for your query.**\n\n"]
+        parts.append("💡 **Try these alternatives:**\n")
+        
+        if 'sales' in question_lower:
+            parts.append("• 'total sales this year'\n• 'sales by city'\n• 'monthly sales trends'")
+        elif 'customer' in question_lower:
+            parts.append("• 'all customers'\n• 'top customers by spending'\n• 'customers by city'")
+        elif 'product' in question_lower:
+            parts.append("• 'all products'\n• 'top selling products'\n• 'worst performing products'")
         else:
-            response += "• 'total sales'\n• 'customer count'\n• 'recent orders'"
+            parts.append("• 'total sales'\n• 'customer count'\n• 'recent orders'")
         
-        return response
+        return ''.join(parts)
 
 # Global instance
 enhanced_formatter = EnhancedResponseFormatter()
@@ -6,6 +6,36 @@ Intelligent Response Formatter - Enhanced response generation with business cont
 from datetime import datetime
 import re
 
+import numpy as np
+
+# Pre-bound number formats for the per-row loops
+_MONEY = "${:,.2f}".format
+_AVG = "${:.2f}".format
+_INT = "{:,}".format
+_PCT = "{:.1f}%".format
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_TIME_RE = re.compile(r'\b(this|last)\s+(year|month)\b')
+
+_NEG_WORDS = frozenset({'worst', 'least', 'bottom', 'lowest'})
+_SALES_WORDS = frozenset({'sales', 'revenue', 'total'})
+_REVENUE_WORDS = frozenset({'sales', 'revenue'})
+_CUSTOMER_WORDS = frozenset({'customer'})
+_PRODUCT_WORDS = frozenset({'product'})
+_ORDER_WORDS = frozenset({'order'})
+
+def _question_tokens(question_lower):
+    """Word tokens of the question, tolerating plurals: 'totals' also counts as 'total'"""
+    words = _TOKEN_RE.findall(question_lower)
+    return frozenset(words).union(word[:-1] for word in words if word.endswith('s'))
+
+def _sales_shares(data):
+    """Each row's totalSales as float64 plus its percentage of the overall total"""
+    sales = np.fromiter((item.get('totalSales', 0) for item in data), dtype=np.float64, count=len(data))
+    total = sales.sum()
+    shares = sales / total * 100.0 if total > 0 else np.zeros_like(sales)
+    return sales, shares
+
 class IntelligentResponseFormatter:
     def __init__(self):
         self.business_context = {
@@ -14,67 +44,60 @@ class IntelligentResponseFormatter:
             'seasonal': 'seasonal patterns and trends',
             'performance': 'business performance metrics'
         }
+        self._dispatch = {
+            'churn_analysis': self._format_churn_analysis,
+            'performance_analysis': self._format_performance_analysis,
+            'seasonal_analysis': self._format_seasonal_analysis,
+            'sales_summary': self._format_sales_summary,
+            'city_analysis': self._format_city_analysis,
+            'count_result': self._format_count_result,
+            'aggregation_result': self._format_aggregation_result,
+        }
     
     def format_intelligent_response(self, question, raw_data, query_type=None):
         """Format response with business intelligence and context"""
         question_lower = question.lower()
+        tokens = _question_tokens(question_lower)
         
         if isinstance(raw_data, str) and "Error" in raw_data:
             return self._format_error_with_suggestions(raw_data, question)
         
         if not isinstance(raw_data, list) or len(raw_data) == 0:
-            return self._format_no_data_with_suggestions(question)
+            return self._format_no_data_with_suggestions(question, tokens)
         
         # Detect response type based on data structure and question
-        response_type = self._detect_response_type(raw_data, question_lower)
-        
-        if response_type == 'churn_analysis':
-            return self._format_churn_analysis(raw_data, question)
-        elif response_type == 'performance_analysis':
-            return self._format_performance_analysis(raw_data, question)
-        elif response_type == 'seasonal_analysis':
-            return self._format_seasonal_analysis(raw_data, question)
-        elif response_type == 'sales_summary':
-            return self._format_sales_summary(raw_data, question)
-        elif response_type == 'customer_analysis':
-            return self._format_customer_analysis(raw_data, question)
-        elif response_type == 'product_analysis':
-            return self._format_product_analysis(raw_data, question)
-        elif response_type == 'city_analysis':
-            return self._format_city_analysis(raw_data, question)
-        elif response_type == 'count_result':
-            return self._format_count_result(raw_data, question)
-        elif response_type == 'aggregation_result':
-            return self._format_aggregation_result(raw_data, question)
-        else:
-            return self._format_generic_list(raw_data, question)
+        response_type = self._detect_response_type(raw_data, tokens)
+        
+        formatter = self._dispatch.get(response_type, self._format_generic_list)
+        return formatter(raw_data, question, tokens)
     
-    def _detect_response_type(self, data, question):
+    def _detect_response_type(self, data, tokens):
         """Intelligently detect the type of response needed"""
         if not data:
             return 'no_data'
         
         first_item = data[0]
+        keys = first_item.keys() if isinstance(first_item, dict) else ()
         
         # Check for churn analysis
-        if 'daysSinceLastOrder' in str(first_item) or 'lastOrderDate' in str(first_item):
+        if 'daysSinceLastOrder' in keys or 'lastOrderDate' in keys:
             return 'churn_analysis'
         
         # Check for seasonal analysis
-        if 'monthName' in str(first_item) and 'totalSales' in str(first_item):
+        if 'monthName' in keys and 'totalSales' in keys:
             return 'seasonal_analysis'
         
         # Check for performance analysis
-        if ('productName' in str(first_item) or 'customerName' in str(first_item)) and 'totalSales' in str(first_item):
+        if ('productName' in keys or 'customerName' in keys) and 'totalSales' in keys:
             return 'performance_analysis'
         
         # Check for city analysis
-        if 'city' in str(first_item) and 'totalSales' in str(first_item):
+        if 'city' in keys and 'totalSales' in keys:
             return 'city_analysis'
         
         # Check for sales summary
-        if isinstance(first_item, dict) and len(first_item) <= 3 and any(key in ['totalSales', 'total'] for key in first_item.keys()):
-            if any(word in question for word in ['sales', 'revenue', 'total']):
+        if len(keys) <= 3 and ('totalSales' in keys or 'total' in keys):
+            if tokens & _SALES_WORDS:
                 return 'sales_summary'
         
         # Check for count results
@@ -87,271 +110,269 @@ class IntelligentResponseFormatter:
         
         return 'generic_list'
     
-    def _format_churn_analysis(self, data, question):
+    def _format_churn_analysis(self, data, question, tokens):
         """Format churn analysis results"""
-        response = f"🚨 **Customer Churn Analysis**\n\n"
-        response += f"Found **{len(data)}** customers who haven't ordered recently:\n\n"
+        parts = [f"🚨 **Customer Churn Analysis**\n\n"]
+        parts.append(f"Found **{len(data)}** customers who haven't ordered recently:\n\n")
         
         for i, customer in enumerate(data[:10], 1):
-            name = customer.get('customerName', 'Unknown')
-            days = int(customer.get('daysSinceLastOrder', 0))
-            total_spent = customer.get('totalSpent', 0)
-            orders = customer.get('totalOrders', 0)
+            get = customer.get
+            name = get('customerName', 'Unknown')
+            days = int(get('daysSinceLastOrder', 0))
+            total_spent = get('totalSpent', 0)
+            orders = get('totalOrders', 0)
             
-            response += f"{i}. **{name}** - {days} days since last order\n"
-            response += f"   💰 Total spent: ${total_spent:,.2f} ({orders} orders)\n\n"
+            parts.append(f"{i}. **{name}** - {days} days since last order\n")
+            parts.append(f"   💰 Total spent: {_MONEY(total_spent)} ({orders} orders)\n\n")
         
         if len(data) > 10:
-            response += f"... and {len(data) - 10} more at-risk customers\n\n"
+            parts.append(f"... and {len(data) - 10} more at-risk customers\n\n")
         
-        response += "💡 **Recommendation:** Consider reaching out with personalized offers to re-engage these customers."
+        parts.append("💡 **Recommendation:** Consider reaching out with personalized offers to re-engage these customers.")
         
-        return response
+        return ''.join(parts)
     
-    def _format_performance_analysis(self, data, question):
+    def _format_performance_analysis(self, data, question, tokens):
         """Format product/customer performance analysis"""
-        question_lower = question.lower()
-        
-        if 'productName' in str(data[0]):
-            if any(word in question_lower for word in ['worst', 'least', 'bottom', 'lowest']):
-                response = "📉 **Worst Performing Products**\n\n"
+        if 'productName' in data[0]:
+            if tokens & _NEG_WORDS:
+                parts = ["📉 **Worst Performing Products**\n\n"]
             else:
-                response = "📈 **Top Performing Products**\n\n"
+                parts = ["📈 **Top Performing Products**\n\n"]
             
             for i, item in enumerate(data[:10], 1):
-                name = item.get('productName', 'Unknown')
-                sales = item.get('totalSales', 0)
-                quantity = item.get('quantitySold', 0)
-                orders = item.get('orderCount', 0)
+                get = item.get
+                name = get('productName', 'Unknown')
+                sales = get('totalSales', 0)
+                quantity = get('quantitySold', 0)
+                orders = get('orderCount', 0)
                 
-                response += f"{i}. **{name}**\n"
-                response += f"   💰 Sales: ${sales:,.2f}\n"
-                response += f"   📦 Units sold: {quantity:,}\n"
-                response += f"   🛒 Orders: {orders:,}\n\n"
-        
-        elif 'customerName' in str(data[0]):
-            if any(word in question_lower for word in ['worst', 'least', 'bottom', 'lowest']):
-                response = "📉 **Lowest Value Customers**\n\n"
+                parts.append(f"{i}. **{name}**\n")
+                parts.append(f"   💰 Sales: {_MONEY(sales)}\n")
+                parts.append(f"   📦 Units sold: {_INT(quantity)}\n")
+                parts.append(f"   🛒 Orders: {_INT(orders)}\n\n")
+        
+        elif 'customerName' in data[0]:
+            if tokens & _NEG_WORDS:
+                parts = ["📉 **Lowest Value Customers**\n\n"]
             else:
-                response = "👑 **Top Value Customers**\n\n"
+                parts = ["👑 **Top Value Customers**\n\n"]
             
             for i, item in enumerate(data[:10], 1):
-                name = item.get('customerName', 'Unknown')
-                spent = item.get('totalSpent', 0)
-                orders = item.get('orderCount', 0)
-                avg_order = item.get('avgOrderValue', 0)
-                city = item.get('customerCity', 'Unknown')
+                get = item.get
+                name = get('customerName', 'Unknown')
+                spent = get('totalSpent', 0)
+                orders = get('orderCount', 0)
+                avg_order = get('avgOrderValue', 0)
+                city = get('customerCity', 'Unknown')
                 
-                response += f"{i}. **{name}** ({city})\n"
-                response += f"   💰 Total spent: ${spent:,.2f}\n"
-                response += f"   🛒 Orders: {orders} (avg: ${avg_order:.2f})\n\n"
+                parts.append(f"{i}. **{name}** ({city})\n")
+                parts.append(f"   💰 Total spent: {_MONEY(spent)}\n")
+                parts.append(f"   🛒 Orders: {orders} (avg: {_AVG(avg_order)})\n\n")
         
-        return response
+        return ''.join(parts)
     
-    def _format_seasonal_analysis(self, data, question):
+    def _format_seasonal_analysis(self, data, question, tokens):
         """Format seasonal analysis results"""
-        response = "📅 **Seasonal Sales Analysis**\n\n"
+        parts = ["📅 **Seasonal Sales Analysis**\n\n"]
         
-        total_sales = sum(item.get('totalSales', 0) for item in data)
+        sales_values, shares = _sales_shares(data)
         
-        for item in data:
-            month = item.get('monthName', 'Unknown')
-            year = item.get('year', 'Unknown')
-            sales = item.get('totalSales', 0)
-            orders = item.get('orderCount', 0)
-            avg_order = item.get('avgOrderValue', 0)
-            
-            percentage = (sales / total_sales * 100) if total_sales > 0 else 0
+        for item, sales, percentage in zip(data, sales_values, shares):
+            get = item.get
+            month = get('monthName', 'Unknown')
+            year = get('year', 'Unknown')
+            orders = get('orderCount', 0)
+            avg_order = get('avgOrderValue', 0)
             
-            response += f"📊 **{month} {year}**\n"
-            response += f"   💰 Sales: ${sales:,.2f} ({percentage:.1f}% of total)\n"
-            response += f"   🛒 Orders: {orders:,} (avg: ${avg_order:.2f})\n\n"
+            parts.append(f"📊 **{month} {year}**\n")
+            parts.append(f"   💰 Sales: {_MONEY(sales)} ({_PCT(percentage)} of total)\n")
+            parts.append(f"   🛒 Orders: {_INT(orders)} (avg: {_AVG(avg_order)})\n\n")
         
-        # Find best and worst months
         if len(data) > 1:
-            best_month = max(data, key=lambda x: x.get('totalSales', 0))
-            worst_month = min(data, key=lambda x: x.get('totalSales', 0))
-            
-            response += f"🏆 **Best month:** {best_month.get('monthName')} (${best_month.get('totalSales', 0):,.2f})\n"
-            response += f"📉 **Slowest month:** {worst_month.get('monthName')} (${worst_month.get('totalSales', 0):,.2f})\n"
+            # argmax/argmin keep the first month on ties
+            best_i = sales_values.argmax()
+            worst_i = sales_values.argmin()
+            parts.append(f"🏆 **Best month:** {data[best_i].get('monthName')} ({_MONEY(sales_values[best_i])})\n")
+            parts.append(f"📉 **Slowest month:** {data[worst_i].get('monthName')} ({_MONEY(sales_values[worst_i])})\n")
         
-        return response    def _for
-mat_sales_summary(self, data, question):
+        return ''.join(parts)
+    
+    def _format_sales_summary(self, data, question, tokens):
         """Format sales summary with business context"""
-        question_lower = question.lower()
         first_item = data[0]
         
         total_sales = first_item.get('totalSales', first_item.get('total', 0))
         order_count = first_item.get('orderCount', 0)
         
-        # Determine time context
-        time_context = ""
-        if 'this year' in question_lower or '2024' in question_lower:
+        # Determine time context; years and phrases share a priority, so
+        # "this year vs 2023" still reports 2024
+        question_lower = question.lower()
+        periods = set(_TIME_RE.findall(question_lower))
+        if '2024' in question_lower or ('this', 'year') in periods:
             time_context = " for 2024"
-        elif 'last year' in question_lower or '2023' in question_lower:
+        elif '2023' in question_lower or ('last', 'year') in periods:
             time_context = " for 2023"
-        elif 'this month' in question_lower:
+        elif ('this', 'month') in periods:
             time_context = " for this month"
-        elif 'last month' in question_lower:
+        elif ('last', 'month') in periods:
             time_context = " for last month"
+        else:
+            time_context = ""
         
-        response = f"💰 **Sales Summary{time_context}**\n\n"
-        response += f"**Total Revenue:** ${total_sales:,.2f}\n"
+        parts = [f"💰 **Sales Summary{time_context}**\n\n"]
+        parts.append(f"**Total Revenue:** {_MONEY(total_sales)}\n")
         
         if order_count > 0:
             avg_order_value = total_sales / order_count
-            response += f"**Total Orders:** {order_count:,}\n"
-            response += f"**Average Order Value:** ${avg_order_value:.2f}\n"
+            parts.append(f"**Total Orders:** {_INT(order_count)}\n")
+            parts.append(f"**Average Order Value:** {_AVG(avg_order_value)}\n")
         
         # Add business insights
         if total_sales > 1000000:
-            response += f"\n🎉 Excellent performance! Revenue exceeded $1M{time_context}."
+            parts.append(f"\n🎉 Excellent performance! Revenue exceeded $1M{time_context}.")
         elif total_sales > 500000:
-            response += f"\n👍 Good performance! Strong revenue{time_context}."
+            parts.append(f"\n👍 Good performance! Strong revenue{time_context}.")
         
-        return response
+        return ''.join(parts)
     
-    def _format_city_analysis(self, data, question):
+    def _format_city_analysis(self, data, question, tokens):
         """Format city-wise analysis"""
-        response = "🗺️ **Sales by Location**\n\n"
+        parts = ["🗺️ **Sales by Location**\n\n"]
         
-        total_sales = sum(item.get('totalSales', 0) for item in data)
+        sales_values, shares = _sales_shares(data)
         
-        for i, item in enumerate(data, 1):
-            city = item.get('city', item.get('_id', 'Unknown'))
-            sales = item.get('totalSales', 0)
-            orders = item.get('orderCount', 0)
-            customers = item.get('customerCount', 0)
-            
-            percentage = (sales / total_sales * 100) if total_sales > 0 else 0
+        for i, (item, sales, percentage) in enumerate(zip(data, sales_values, shares), 1):
+            get = item.get
+            city = get('city', get('_id', 'Unknown'))
+            orders = get('orderCount', 0)
+            customers = get('customerCount', 0)
             
-            response += f"{i}. **{city}**\n"
-            response += f"   💰 Sales: ${sales:,.2f} ({percentage:.1f}%)\n"
-            response += f"   🛒 Orders: {orders:,}\n"
+            parts.append(f"{i}. **{city}**\n")
+            parts.append(f"   💰 Sales: {_MONEY(sales)} ({_PCT(percentage)})\n")
+            parts.append(f"   🛒 Orders: {_INT(orders)}\n")
             if customers > 0:
-                response += f"   👥 Customers: {customers:,}\n"
-            response += "\n"
+                parts.append(f"   👥 Customers: {_INT(customers)}\n")
+            parts.append("\n")
         
-        return response
+        return ''.join(parts)
     
-    def _format_count_result(self, data, question):
+    def _format_count_result(self, data, question, tokens):
         """Format count results with business context"""
-        question_lower = question.lower()
         count = data[0].get('total', 0)
         
         # Determine what we're counting
-        if 'customer' in question_lower:
+        if tokens & _CUSTOMER_WORDS:
             entity = 'customers'
             emoji = '👥'
-        elif 'product' in question_lower:
+        elif tokens & _PRODUCT_WORDS:
             entity = 'products'
             emoji = '📦'
-        elif 'order' in question_lower:
+        elif tokens & _ORDER_WORDS:
             entity = 'orders'
             emoji = '🛒'
         else:
             entity = 'records'
             emoji = '📊'
         
-        response = f"{emoji} **{entity.title()} Count**\n\n"
-        response += f"Total {entity}: **{count:,}**\n"
+        parts = [f"{emoji} **{entity.title()} Count**\n\n"]
+        parts.append(f"Total {entity}: **{_INT(count)}**\n")
         
         # Add business context
         if entity == 'customers' and count > 1000:
-            response += "\n🎯 Great customer base! Consider segmentation strategies."
+            parts.append("\n🎯 Great customer base! Consider segmentation strategies.")
         elif entity == 'orders' and count > 5000:
-            response += "\n📈 High order volume! Strong business activity."
+            parts.append("\n📈 High order volume! Strong business activity.")
         
-        return response
+        return ''.join(parts)
     
-    def _format_aggregation_result(self, data, question):
+    def _format_aggregation_result(self, data, question, tokens):
         """Format aggregation results"""
-        question_lower = question.lower()
         first_item = data[0]
         
         for key, value in first_item.items():
             if key != '_id' and isinstance(value, (int, float)):
-                if any(word in question_lower for word in ['sales', 'revenue']):
-                    return f"💰 **Total Sales:** ${value:,.2f}"
-                elif 'average' in question_lower:
-                    return f"📊 **Average Value:** ${value:.2f}"
-                elif 'max' in key.lower() or 'highest' in question_lower:
-                    return f"📈 **Maximum Value:** ${value:,.2f}"
-                elif 'min' in key.lower() or 'lowest' in question_lower:
-                    return f"📉 **Minimum Value:** ${value:,.2f}"
+                if tokens & _REVENUE_WORDS:
+                    return f"💰 **Total Sales:** {_MONEY(value)}"
+                elif 'average' in tokens:
+                    return f"📊 **Average Value:** {_AVG(value)}"
+                elif 'max' in key.lower() or 'highest' in tokens:
+                    return f"📈 **Maximum Value:** {_MONEY(value)}"
+                elif 'min' in key.lower() or 'lowest' in tokens:
+                    return f"📉 **Minimum Value:** {_MONEY(value)}"
                 else:
                     return f"📊 **Result:** {value:,.2f}"
         
         return f"📊 **Result:** {first_item}"
     
-    def _format_generic_list(self, data, question):
+    def _format_generic_list(self, data, question, tokens):
         """Format generic list results"""
-        response = "📋 **Results:**\n\n"
+        parts = ["📋 **Results:**\n\n"]
         
         for i, item in enumerate(data[:10], 1):
             if isinstance(item, dict):
                 # Format based on available fields
                 if 'name' in item:
-                    response += f"{i}. **{item['name']}**"
+                    parts.append(f"{i}. **{item['name']}**")
                     if 'email' in item:
-                        response += f" - {item['email']}"
+                        parts.append(f" - {item['email']}")
                     if 'city' in item:
-                        response += f" ({item['city']})"
+                        parts.append(f" ({item['city']})")
                     if 'price' in item:
-                        response += f" - ${item['price']}"
-                    response += "\n"
+                        parts.append(f" - ${item['price']}")
+                    parts.append("\n")
                 else:
                     # Generic formatting
                     fields = [f"{k}: {v}" for k, v in item.items() if k != '_id'][:3]
-                    response += f"{i}. {' | '.join(fields)}\n"
+                    parts.append(f"{i}. {' | '.join(fields)}\n")
             else:
-                response += f"{i}. {item}\n"
+                parts.append(f"{i}. {item}\n")
         
         if len(data) > 10:
-            response += f"\n... and {len(data) - 10} more results"
+            parts.append(f"\n... and {len(data) - 10} more results")
         
-        return response
+        return ''.join(parts)
     
     def _format_error_with_suggestions(self, error, question):
         """Format error messages with helpful suggestions"""
-        response = f"❌ **Error:** {error}\n\n"
-        response += "💡 **Suggestions:**\n"
+        parts = [f"❌ **Error:** {error}\n\n"]
+        parts.append("💡 **Suggestions:**\n")
         
         if 'no data' in error.lower():
-            response += "• Try a different time period (e.g., 'last year', 'this month')\n"
-            response += "• Check if the data exists in your database\n"
-            response += "• Try a broader query (e.g., 'all sales' instead of specific filters)\n"
+            parts.append("• Try a different time period (e.g., 'last year', 'this month')\n")
+            parts.append("• Check if the data exists in your database\n")
+            parts.append("• Try a broader query (e.g., 'all sales' instead of specific filters)\n")
         
-        response += "\n🔍 **Example queries:**\n"
-        response += "• 'total sales this year'\n"
-        response += "• 'top 10 customers'\n"
-        response += "• 'products by sales'\n"
+        parts.append("\n🔍 **Example queries:**\n")
+        parts.append("• 'total sales this year'\n")
+        parts.append("• 'top 10 customers'\n")
+        parts.append("• 'products by sales'\n")
         
-        return response
+        return ''.join(parts)
     
-    def _format_no_data_with_suggestions(self, question):
+    def _format_no_data_with_suggestions(self, question, tokens):
         """Format no data response with suggestions"""
-        response = "🔍 **No data found for your query.**\n\n"
-        response += "💡 **Try these alternatives:**\n"
-        
-        if 'sales' in question.lower():
-            response += "• 'total sales' (all time)\n"
-            response += "• 'sales this year'\n"
-            response += "• 'sales by city'\n"
-        elif 'customer' in question.lower():
-            response += "• 'all customers'\n"
-            response += "• 'top customers by spending'\n"
-            response += "• 'customers by city'\n"
-        elif 'product' in question.lower():
-            response += "• 'all products'\n"
-            response += "• 'top selling products'\n"
-            response += "• 'products by category'\n"
+        parts = ["🔍 **No data found for your query.**\n\n"]
+        parts.append("💡 **Try these alternatives:**\n")
+        
+        if 'sales' in tokens:
+            parts.append("• 'total sales' (all time)\n")
+            parts.append("• 'sales this year'\n")
+            parts.append("• 'sales by city'\n")
+        elif tokens & _CUSTOMER_WORDS:
+            parts.append("• 'all customers'\n")
+            parts.append("• 'top customers by spending'\n")
+            parts.append("• 'customers by city'\n")
+        elif tokens & _PRODUCT_WORDS:
+            parts.append("• 'all products'\n")
+            parts.append("• 'top selling products'\n")
+            parts.append("• 'products by category'\n")
         else:
-            response += "• 'total sales'\n"
-            response += "• 'customer count'\n"
-            response += "• 'recent orders'\n"
+            parts.append("• 'total sales'\n")
+            parts.append("• 'customer count'\n")
+            parts.append("• 'recent orders'\n")
         
-        return response
+        return ''.join(parts)
 
 # Global instance
 intelligent_formatter = IntelligentResponseFormatter()
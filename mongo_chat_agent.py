@@ -1,20 +1,58 @@
 import os
+import asyncio
+import hashlib
 import json
-import pickle
+import logging
+import re
+import threading
+import time
 import numpy as np
 import requests  # ✅ FIX 1: Added missing import
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import ast  # ✅ FIX 2: Added missing import
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, List, Tuple, Optional
 from sentence_transformers import SentenceTransformer
 from pymongo import MongoClient
 from bson import ObjectId
 import subprocess
 
+# Per-query diagnostics (model output, template fallbacks); enable with
+# logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
 # ============================================================================
 # MONGODB CONNECTION & SCHEMA EXTRACTION
 # ============================================================================
 
+# Update operators that must never reach find()
+_FORBIDDEN_OPS = frozenset({'$set', '$unset', '$push', '$pull', '$rename', '$inc', '$mul'})
+# Applied by the structural walk to keys (case variants of the operators above)
+# and to server-side JavaScript, never to ordinary data values
+_FORBIDDEN_RE = re.compile(
+    r'\$(?:set|unset|push|pull|rename|inc|mul)\b|\b(?:deleteOne|deleteMany|updateOne|updateMany|drop)\s*\(',
+    re.IGNORECASE
+)
+
+# motor is optional; without it the async query path runs pymongo in worker threads
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    MOTOR_AVAILABLE = True
+except ImportError:
+    MOTOR_AVAILABLE = False
+
+# Server-side cap on count queries built from model output
+COUNT_MAX_TIME_MS = 5000
+# Documents scanned per collection for the stable field list
+FIELD_SCAN_DOCS = 20
+
+# Operators whose arguments are JavaScript run by the server
+_JS_OPS = frozenset({'$where', '$function', '$accumulator'})
+
 class MongoDBConnector:
     """Connect to MongoDB and extract schema"""
     
@@ -22,6 +60,14 @@ class MongoDBConnector:
         self.connection_string = connection_string
         self.client = None
         self.db = None
+        self.database_name = None
+        # motor client for the async query path, bound to the loop that created it
+        self.async_client = None
+        self.async_db = None
+        self._async_loop = None
+        # collection name -> (fetched_at, sample fields); schemas rarely change mid-session
+        self._field_cache: Dict[str, Tuple[float, Dict]] = {}
+        self._field_cache_ttl = 300.0
     
     def connect(self, database_name='ai_test_db'):  # ✅ FIX 3: Changed from 'ai-test-db'
         """Connect to MongoDB"""
@@ -29,6 +75,8 @@ class MongoDBConnector:
             self.client = MongoClient(self.connection_string, serverSelectionTimeoutMS=5000)
             self.client.admin.command('ping')
             self.db = self.client[database_name]
+            self.database_name = database_name
+            self._field_cache.clear()
             # print(f"✓ Connected to MongoDB: {database_name}")
             return True
         except Exception as e:
@@ -45,10 +93,11 @@ class MongoDBConnector:
             
             try:
                 collection = self.db[collection_name]
-                doc_count = collection.count_documents({})
+                # Collection metadata count; the description only needs an approximation
+                doc_count = collection.estimated_document_count()
                 
                 # Simple schema inference from one document
-                sample_doc = collection.find_one()
+                sample_doc = self._sample_document(collection)
                 fields_desc = {}
                 
                 if sample_doc:
@@ -64,6 +113,7 @@ class MongoDBConnector:
                 schema[collection_name] = {
                     "description": f"Collection with {len(fields_desc)} fields and {doc_count} documents",
                     "fields": fields_desc,
+                    "field_names": self._stable_field_names(collection, fields_desc),
                     "doc_count": doc_count,
                     "indexed_fields": indexes
                 }
@@ -72,11 +122,29 @@ class MongoDBConnector:
         
         return schema
 
+    def _stable_field_names(self, collection, sampled_fields: Dict) -> List[str]:
+        """Sorted union of field names over the first documents in natural order
+        
+        Unlike the random $sample this is the same set on every start, so it
+        can key caches; optional fields present in any of those docs count.
+        """
+        names = set(sampled_fields)
+        try:
+            for doc in collection.find({}, limit=FIELD_SCAN_DOCS):
+                names.update(doc)
+        except Exception as e:
+            print(f"Warning: Could not scan fields of {collection.name}: {e}")
+        return sorted(names)
+    
     def get_collection_sample_fields(self, collection_name: str) -> Dict:
         """Get actual field names and sample values from collection"""
+        entry = self._field_cache.get(collection_name)
+        if entry and time.time() - entry[0] < self._field_cache_ttl:
+            return entry[1]
+        
         try:
             collection = self.db[collection_name]
-            sample_doc = collection.find_one()
+            sample_doc = self._sample_document(collection)
             
             if sample_doc:
                 actual_fields = {}
@@ -87,22 +155,40 @@ class MongoDBConnector:
                         'type': field_type,
                         'sample': str(value)[:50]  # First 50 chars of sample
                     }
+                self._field_cache[collection_name] = (time.time(), actual_fields)
                 return actual_fields
         except Exception as e:
             print(f"Error getting sample fields: {e}")
         
         return {}
     
-    def execute_query(self, collection_name: str, query: Dict) -> List[Dict]:
+    def ensure_join_indexes(self):
+        """Index the orders -> customers join key used by the join template"""
+        try:
+            if 'orders' in self.db.list_collection_names():
+                self.db['orders'].create_index('customerId')
+        except Exception as e:
+            # Read-only users can't create indexes; the join still works without it
+            print(f"Warning: Could not index orders.customerId: {e}")
+    
+    def _sample_document(self, collection) -> Optional[Dict]:
+        """One random document with a bounded server time, falling back to find_one()"""
+        try:
+            return next(collection.aggregate([{'$sample': {'size': 1}}], maxTimeMS=500), None)
+        except Exception:
+            return collection.find_one(projection=None)
+    
+    def execute_query(self, collection_name: str, query: Dict, projection: Optional[Dict] = None) -> List[Dict]:
         """Execute MongoDB query and return results"""
         try:
             collection = self.db[collection_name]
             
             # Safety check - prevent data modification
-            if any(op in str(query).lower() for op in ['$set', '$unset', '$push', '$pull', 'deleteOne', 'deleteMany', 'updateOne', 'updateMany', 'drop']):
+            if self._has_forbidden(query):
                 return {"error": "Data modification queries are not allowed"}
             
-            results = list(collection.find(query).limit(10))
+            # Only ship the fields the caller needs
+            results = list(collection.find(query, projection).limit(10))
             
             # Convert ObjectId to string for JSON serialization
             for doc in results:
@@ -112,105 +198,284 @@ class MongoDBConnector:
             return results
         except Exception as e:
             return {"error": str(e)}
+    
+    def count_documents(self, collection_name: str, query: Dict) -> int:
+        """Count matches; an empty filter reads collection metadata instead of scanning"""
+        collection = self.db[collection_name]
+        if not query:
+            return collection.estimated_document_count(maxTimeMS=COUNT_MAX_TIME_MS)
+        return collection.count_documents(query, maxTimeMS=COUNT_MAX_TIME_MS)
+    
+    def _motor_db(self):
+        """motor database handle for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self.async_db is None or self._async_loop is not loop:
+            if self.async_client is not None:
+                self.async_client.close()
+            self.async_client = AsyncIOMotorClient(self.connection_string, serverSelectionTimeoutMS=5000)
+            self.async_db = self.async_client[self.database_name]
+            self._async_loop = loop
+        return self.async_db
+    
+    async def aexecute_query(self, collection_name: str, query: Dict, projection: Optional[Dict] = None) -> List[Dict]:
+        """execute_query without blocking the event loop"""
+        if not MOTOR_AVAILABLE:
+            return await asyncio.to_thread(self.execute_query, collection_name, query, projection)
+        try:
+            if self._has_forbidden(query):
+                return {"error": "Data modification queries are not allowed"}
+            
+            results = await self._motor_db()[collection_name].find(query, projection).to_list(length=10)
+            for doc in results:
+                if '_id' in doc:
+                    doc['_id'] = str(doc['_id'])
+            return results
+        except Exception as e:
+            return {"error": str(e)}
+    
+    async def aaggregate(self, collection_name: str, pipeline: List[Dict], limit: Optional[int] = 10) -> List[Dict]:
+        """Run a pipeline and read at most limit documents (all when None)"""
+        options = {'batchSize': limit} if limit else {}
+        if not MOTOR_AVAILABLE:
+            def run():
+                return list(islice(self.db[collection_name].aggregate(pipeline, **options), limit))
+            return await asyncio.to_thread(run)
+        cursor = self._motor_db()[collection_name].aggregate(pipeline, **options)
+        return await cursor.to_list(length=limit)
+    
+    async def acount_documents(self, collection_name: str, query: Dict) -> int:
+        if not MOTOR_AVAILABLE:
+            return await asyncio.to_thread(self.count_documents, collection_name, query)
+        collection = self._motor_db()[collection_name]
+        if not query:
+            return await collection.estimated_document_count(maxTimeMS=COUNT_MAX_TIME_MS)
+        return await collection.count_documents(query, maxTimeMS=COUNT_MAX_TIME_MS)
+    
+    def _has_forbidden(self, q) -> bool:
+        """Walk the query structure looking for update operator keys and JS shell calls"""
+        if isinstance(q, dict):
+            for key, value in q.items():
+                if key in _FORBIDDEN_OPS or (isinstance(key, str) and _FORBIDDEN_RE.search(key)):
+                    return True
+                if key in _JS_OPS and _FORBIDDEN_RE.search(str(value)):
+                    return True
+                if self._has_forbidden(value):
+                    return True
+        elif isinstance(q, list):
+            return any(self._has_forbidden(item) for item in q)
+        return False
 
 
 # ============================================================================
 # EMBEDDING & VECTOR SEARCH
 # ============================================================================
 
+# torch ships with sentence-transformers, but quantization is only an optimization
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+
+def _quantize_int8(model: SentenceTransformer) -> bool:
+    """Swap the transformer's Linear layers for dynamic int8 ones on CPU"""
+    if not TORCH_AVAILABLE or model.device.type != 'cpu':
+        return False
+    try:
+        transformer = model[0]
+        transformer.auto_model = torch.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        return True
+    except Exception as e:
+        print(f"Warning: int8 quantization skipped: {e}")
+        return False
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    """Stack vectors into a float32 matrix with L2-normalized rows"""
+    if not len(vectors):
+        return np.empty((0, 0), dtype=np.float32)
+    matrix = np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors stay zero and score 0 against any question
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _rank_by_similarity(names: List[str], matrix: np.ndarray, query: np.ndarray, top_k: int) -> List[Tuple]:
+    """Cosine-rank matrix rows against a unit-length query in one matrix-vector product"""
+    k = min(top_k, len(names))
+    if k <= 0:
+        return []
+    
+    similarities = matrix @ query
+    
+    # Partial selection of the top k, then sort just those
+    if k < len(names):
+        top = np.argpartition(-similarities, k - 1)[:k]
+    else:
+        top = np.arange(len(names))
+    top = top[np.argsort(-similarities[top], kind='stable')]
+    return [(names[i], float(similarities[i])) for i in top]
+
+
 class VectorSearchEngine:
     """Generate embeddings and perform semantic search"""
     
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
+    def __init__(self, model_name='all-MiniLM-L6-v2', quantize=True):
         self.model = SentenceTransformer(model_name)
+        # Int8 Linear layers run ~2-4x faster on CPU with negligible ranking drift
+        self.quantized = quantize and _quantize_int8(self.model)
         self.embeddings_db = {}
+        # Chat users repeat questions; skip the transformer pass for those
+        self._encode_question = lru_cache(maxsize=512)(self._encode_question_uncached)
+        # Pay tokenizer and first-forward setup at startup rather than on the first question
+        self.model.encode("warmup")
+    
+    def _encode_question_uncached(self, text: str) -> np.ndarray:
+        """Unit-length float32 embedding of a question"""
+        embedding = np.asarray(self.model.encode(text, normalize_embeddings=True), dtype=np.float32)
+        # Cached arrays are shared between callers
+        embedding.setflags(write=False)
+        return embedding
+    
+    @property
+    def embeddings_db(self) -> Dict:
+        return self._embeddings_db
+    
+    @embeddings_db.setter
+    def embeddings_db(self, embeddings_db: Dict):
+        self._embeddings_db = embeddings_db
+        self._rebuild_matrices()
+    
+    def _rebuild_matrices(self):
+        """Stack normalized embeddings so each search is a single matrix product"""
+        # Stored vectors are already unit-norm; renormalizing absorbs float16 rounding
+        self._coll_names = list(self._embeddings_db)
+        self._coll_matrix = _unit_rows([
+            data['collection_embedding'] for data in self._embeddings_db.values()
+        ])
+        self._field_matrices = {}
+        for collection_name, data in self._embeddings_db.items():
+            field_embeddings = data['field_embeddings']
+            self._field_matrices[collection_name] = (
+                list(field_embeddings),
+                _unit_rows(list(field_embeddings.values()))
+            )
     
     def generate_embeddings(self, schema: Dict) -> Dict:
-        """Generate embeddings for all collections"""
+        """Generate unit-norm embeddings for all collections"""
+        # Encode every collection and field description in one batched pass
+        texts = []
         for collection_name, collection_info in schema.items():
-            # Collection embedding
-            collection_text = f"{collection_name}: {collection_info['description']}"
-            collection_embedding = self.model.encode(collection_text)
-            
-            # Field embeddings
-            field_embeddings = {}
+            texts.append(f"{collection_name}: {collection_info['description']}")
             for field_name, field_desc in collection_info['fields'].items():
-                field_text = f"{field_name}: {field_desc}"
-                field_embedding = self.model.encode(field_text)
-                field_embeddings[field_name] = field_embedding.tolist()
+                texts.append(f"{field_name}: {field_desc}")
+        
+        if not texts:
+            self._rebuild_matrices()
+            return self.embeddings_db
+        
+        embeddings = self.model.encode(
+            texts,
+            batch_size=64,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32)
+        
+        # Walk the schema in the same order to hand the vectors back out
+        vectors = iter(embeddings)
+        for collection_name, collection_info in schema.items():
+            collection_embedding = next(vectors)
+            field_embeddings = {
+                field_name: next(vectors) for field_name in collection_info['fields']
+            }
             
             # Store
             self.embeddings_db[collection_name] = {
                 "description": collection_info['description'],
-                "collection_embedding": collection_embedding.tolist(),
+                "collection_embedding": collection_embedding,
                 "fields": collection_info['fields'],
                 "field_embeddings": field_embeddings,
                 "doc_count": collection_info['doc_count'],
                 "indexed_fields": collection_info['indexed_fields']
             }
         
+        self._rebuild_matrices()
         return self.embeddings_db
     
-    def save_embeddings(self, filepath='embeddings.pkl'):
-        """Save embeddings to file"""
+    def save_embeddings(self, filepath='embeddings.npy'):
+        """Save embeddings as one float16 matrix plus a JSON sidecar of metadata
+
+        Every row is a unit-norm vector, so similarity against a normalized
+        question embedding is a plain dot product.
+        """
+        rows = []
+        metadata = []
+        for collection_name, data in self.embeddings_db.items():
+            rows.append(data['collection_embedding'])
+            rows.extend(data['field_embeddings'].values())
+            metadata.append({
+                "name": collection_name,
+                "description": data['description'],
+                "fields": data['fields'],
+                "field_names": list(data['field_embeddings']),
+                "doc_count": data['doc_count'],
+                "indexed_fields": data['indexed_fields']
+            })
+        
+        # Vectors are unit-norm, so half precision keeps rankings intact
+        matrix = np.stack(rows).astype(np.float16) if rows else np.empty((0, 0), dtype=np.float16)
         with open(filepath, 'wb') as f:
-            pickle.dump(self.embeddings_db, f)
+            np.save(f, matrix)
+        with open(os.path.splitext(filepath)[0] + '.json', 'w') as f:
+            json.dump(metadata, f)
     
-    def load_embeddings(self, filepath='embeddings.pkl'):
-        """Load embeddings from file"""
-        if os.path.exists(filepath):
-            with open(filepath, 'rb') as f:
-                self.embeddings_db = pickle.load(f)
-            return True
-        return False
+    def load_embeddings(self, filepath='embeddings.npy'):
+        """Load embeddings saved by save_embeddings, memory-mapping the matrix"""
+        metadata_path = os.path.splitext(filepath)[0] + '.json'
+        if not (os.path.exists(filepath) and os.path.exists(metadata_path)):
+            return False
+        
+        matrix = np.load(filepath, mmap_mode='r')
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        
+        # Rows are laid out collection vector first, then its field vectors
+        embeddings_db = {}
+        row = 0
+        for entry in metadata:
+            field_names = entry['field_names']
+            embeddings_db[entry['name']] = {
+                "description": entry['description'],
+                "collection_embedding": matrix[row],
+                "fields": entry['fields'],
+                "field_embeddings": {
+                    field_name: matrix[row + 1 + i] for i, field_name in enumerate(field_names)
+                },
+                "doc_count": entry['doc_count'],
+                "indexed_fields": entry['indexed_fields']
+            }
+            row += 1 + len(field_names)
+        
+        self.embeddings_db = embeddings_db
+        return True
     
     def search_collections(self, user_question: str, top_k: int = 3) -> List[Tuple]:
         """Find most relevant collections for user question"""
-        question_embedding = self.model.encode(user_question)
-        question_embedding = np.array(question_embedding)
-        
-        similarities = {}
-        for collection_name, collection_data in self.embeddings_db.items():
-            collection_embedding = np.array(collection_data['collection_embedding'])
-            norm1 = np.linalg.norm(question_embedding)
-            norm2 = np.linalg.norm(collection_embedding)
-            
-            if norm1 == 0 or norm2 == 0:
-                similarity = 0.0
-            else:
-                similarity = np.dot(question_embedding, collection_embedding) / (norm1 * norm2)
-            
-            similarities[collection_name] = similarity
-        
-        top_collections = sorted(similarities.items(), key=lambda x: x[1], reverse=True)[:top_k]
-        return top_collections
+        question_embedding = self._encode_question(user_question)
+        return _rank_by_similarity(self._coll_names, self._coll_matrix, question_embedding, top_k)
     
     def search_fields(self, user_question: str, collection_name: str, top_k: int = 3) -> List[Tuple]:
         """Find most relevant fields in a collection"""
-        if collection_name not in self.embeddings_db:
+        if collection_name not in self._field_matrices:
             return []
         
-        question_embedding = self.model.encode(user_question)
-        question_embedding = np.array(question_embedding)
-        
-        collection_data = self.embeddings_db[collection_name]
-        field_embeddings = collection_data['field_embeddings']
-        
-        field_similarities = {}
-        for field_name, field_embedding in field_embeddings.items():
-            field_embedding = np.array(field_embedding)
-            norm1 = np.linalg.norm(question_embedding)
-            norm2 = np.linalg.norm(field_embedding)
-            
-            if norm1 == 0 or norm2 == 0:
-                similarity = 0.0
-            else:
-                similarity = np.dot(question_embedding, field_embedding) / (norm1 * norm2)
-            
-            field_similarities[field_name] = similarity
-        
-        top_fields = sorted(field_similarities.items(), key=lambda x: x[1], reverse=True)[:top_k]
-        return top_fields
+        question_embedding = self._encode_question(user_question)
+        field_names, field_matrix = self._field_matrices[collection_name]
+        return _rank_by_similarity(field_names, field_matrix, question_embedding, top_k)
 
 
 # ============================================================================
@@ -220,10 +485,15 @@ class VectorSearchEngine:
 class PromptBuilder:
     """Build optimized prompts for MongoDB queries"""
     
-    def __init__(self, embeddings_db: Dict, db_connector):
+    # Bump when the prompt text or context selection changes; part of the LLM cache key
+    PROMPT_VERSION = 1
+    
+    def __init__(self, embeddings_db: Dict, db_connector,
+                 search_engine: Optional[VectorSearchEngine] = None):
         self.embeddings_db = embeddings_db
         self.db_connector = db_connector
-        self.search_engine = VectorSearchEngine()
+        # Share the caller's engine so the encoder is only loaded and warmed once
+        self.search_engine = search_engine or VectorSearchEngine()
         self.search_engine.embeddings_db = embeddings_db
     
     def build_context(self, user_question: str, top_k_collections: int = 3) -> str:
@@ -233,13 +503,18 @@ class PromptBuilder:
         if not relevant_collections or relevant_collections[0][1] < 0.3:
             return "NO_RELEVANT_COLLECTION"
         
+        # A confident best match doesn't need runner-ups padding the prompt
+        top_score = relevant_collections[0][1]
+        if top_score > 0.75:
+            relevant_collections = relevant_collections[:1]
+        elif top_score > 0.5:
+            relevant_collections = relevant_collections[:2]
+        relevant_collections = [(name, score) for name, score in relevant_collections if score >= 0.2]
+        
         context = "## Available MongoDB Collections\n\n"
         context += "⚠️ IMPORTANT: Use ONLY the field names shown below. Do NOT invent field names.\n\n"
         
         for collection_name, similarity_score in relevant_collections:
-            if similarity_score < 0.2:
-                continue
-            
             collection_data = self.embeddings_db[collection_name]
             
             context += f"### Collection: `{collection_name}`\n"
@@ -321,47 +596,423 @@ Return ONLY the query code, no explanation."""
 # LLM INTEGRATION (Qwen2.5 3B Local via Ollama API)
 # ============================================================================
 
+# httpx is optional; without it the async API falls back to worker threads
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+# orjson encodes request bodies and parses responses / model output
+# several times faster than the stdlib when installed
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    _json_loads = json.loads
+
+# Ollama replies are small and local, so ask for them uncompressed rather than
+# paying for gzip on both ends
+# Seconds to batch new LLM cache entries before rewriting the cache file
+CACHE_SAVE_DELAY = 2.0
+
+_JSON_HEADERS = {'Content-Type': 'application/json', 'Accept-Encoding': 'identity'}
+
+
 class LocalLLMInterface:
     """Interface with local Qwen2.5 3B model via Ollama API"""
     
-    def __init__(self, model_name='qwen2.5:3b', api_url='http://localhost:11434'):
+    def __init__(self, model_name='qwen2.5:3b', api_url='http://localhost:11434', cache_size=512,
+                 keep_alive='30m', cache_path: Optional[str] = None):
         self.model_name = model_name
         self.api_url = api_url
+        self.keep_alive = keep_alive
+        # Keep-alive sockets to Ollama instead of a new connection per question
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=16,
+            max_retries=Retry(total=2, backoff_factor=0.2)
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Created on first async use and rebuilt when the event loop changes,
+        # since an httpx client can't outlive the loop it was opened on
+        self._async_client = None
+        self._async_loop = None
+        # Deterministic (temperature 0) answers keyed by prompt hash, oldest first
+        self.cache_size = cache_size
+        self._response_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # With a cache_path new answers are saved shortly after they arrive, since
+        # long-lived hosts (e.g. Streamlit's cached agent) never get to call close().
+        # Saves run on a timer thread, batching bursts and staying off event loops
+        self.cache_path = cache_path
+        self._save_lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        if cache_path:
+            self.load_cache(cache_path)
+    
+    def _payload(self, system_prompt: str, user_prompt: str, temperature: float) -> Dict:
+        """Ollama /api/generate request body"""
+        return {
+            "model": self.model_name,
+            "prompt": f"{system_prompt}\n\n{user_prompt}",
+            "stream": False,
+            # Keep the model resident between questions instead of reloading it
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": temperature,
+                "num_predict": 120  # Reduced to 120 for faster CPU performance (8GB RAM optimization)
+            }
+        }
+    
+    def _cache_key(self, system_prompt: str, user_prompt: str, temperature: float,
+                   cache_key: Optional[str] = None) -> Optional[str]:
+        """Response-cache key, or None when sampling makes the output non-deterministic
+        
+        cache_key, when given, stands in for the prompts; callers use it when
+        the prompt text varies (e.g. sampled field values) for the same request.
+        """
+        if temperature != 0:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        parts = (cache_key,) if cache_key is not None else (system_prompt, user_prompt)
+        for part in (self.model_name, *parts):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
     
-    def generate(self, system_prompt: str, user_prompt: str, temperature: float = 0) -> str:
+    def _cache_get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        with self._cache_lock:
+            response = self._response_cache.get(key)
+            if response is not None:
+                self._response_cache.move_to_end(key)
+            return response
+    
+    def _cache_put(self, key: Optional[str], response: str):
+        # Connection failures and HTTP errors should be retried next time
+        if key is None or response.startswith("ERROR:"):
+            return
+        with self._cache_lock:
+            self._response_cache[key] = response
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.cache_size:
+                self._response_cache.popitem(last=False)
+            if self.cache_path and self._save_timer is None:
+                self._save_timer = threading.Timer(CACHE_SAVE_DELAY, self.flush_cache)
+                self._save_timer.start()
+    
+    def flush_cache(self):
+        """Write pending cache entries to cache_path now"""
+        with self._cache_lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is None:
+            return
+        timer.cancel()
+        try:
+            self.save_cache(self.cache_path)
+        except OSError as e:
+            print(f"Warning: Could not save LLM cache: {e}")
+    
+    def load_cache(self, filepath='llm_cache.json') -> bool:
+        """Prime the response cache from a previous session"""
+        if not os.path.exists(filepath):
+            return False
+        try:
+            with open(filepath) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._cache_lock:
+            self._response_cache.update(entries)
+            while len(self._response_cache) > self.cache_size:
+                self._response_cache.popitem(last=False)
+        return True
+    
+    def save_cache(self, filepath='llm_cache.json'):
+        """Persist the response cache, least recently used first"""
+        with self._cache_lock:
+            entries = dict(self._response_cache)
+        # Replace atomically so a crash mid-write can't leave a truncated file
+        with self._save_lock:
+            tmp_path = f"{filepath}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, filepath)
+    
+    def warmup(self) -> bool:
+        """Load the model into Ollama's memory ahead of the first question
+        
+        A request without a prompt only loads the model, so nothing is
+        generated or cached.
+        """
+        try:
+            response = self.session.post(
+                f"{self.api_url}/api/generate",
+                data=_json_dumps({"model": self.model_name, "keep_alive": self.keep_alive}),
+                headers=_JSON_HEADERS,
+                timeout=60
+            )
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+    
+    def generate(self, system_prompt: str, user_prompt: str, temperature: float = 0,
+                 cache_key: Optional[str] = None) -> str:
         """Generate response using local Qwen2.5 model via Ollama API"""
+        key = self._cache_key(system_prompt, user_prompt, temperature, cache_key)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
         try:
-            full_prompt = f"{system_prompt}\n\n{user_prompt}"
+            payload = self._payload(system_prompt, user_prompt, temperature)
             
-            payload = {
-                "model": self.model_name,
-                "prompt": full_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    "num_predict": 120  # Reduced to 120 for faster CPU performance (8GB RAM optimization)
-                }
-            }
-            
-            response = requests.post(
+            response = self.session.post(
                 f"{self.api_url}/api/generate", 
-                json=payload, 
+                data=_json_dumps(payload),
+                headers=_JSON_HEADERS,
                 timeout=60  # Increased to 60s for slower hardware
             )
             
             if response.status_code == 200:
-                return response.json().get('response', '').strip()
+                text = _json_loads(response.content).get('response', '').strip()
             else:
-                return f"ERROR: Ollama API returned {response.status_code}"
+                text = f"ERROR: Ollama API returned {response.status_code}"
+        
+        except Exception as e:
+            text = f"ERROR: Failed to connect to Ollama API: {str(e)}"
+        
+        self._cache_put(key, text)
+        return text
+    
+    def _client_for_loop(self):
+        """httpx client owned by the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            # A client from an earlier (now finished) asyncio.run() is unusable;
+            # its connections went away with that loop
+            self._async_client = httpx.AsyncClient(
+                base_url=self.api_url,
+                limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+                timeout=60
+            )
+            self._async_loop = loop
+        return self._async_client
+    
+    async def agenerate(self, system_prompt: str, user_prompt: str, temperature: float = 0,
+                        cache_key: Optional[str] = None) -> str:
+        """Async generate over a pooled keep-alive connection"""
+        if not HTTPX_AVAILABLE:
+            return await asyncio.to_thread(self.generate, system_prompt, user_prompt, temperature, cache_key)
+        
+        key = self._cache_key(system_prompt, user_prompt, temperature, cache_key)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            client = self._client_for_loop()
+            payload = self._payload(system_prompt, user_prompt, temperature)
+            response = await client.post(
+                "/api/generate", content=_json_dumps(payload), headers=_JSON_HEADERS
+            )
+            
+            if response.status_code == 200:
+                text = _json_loads(response.content).get('response', '').strip()
+            else:
+                text = f"ERROR: Ollama API returned {response.status_code}"
+        
+        except Exception as e:
+            text = f"ERROR: Failed to connect to Ollama API: {str(e)}"
+        
+        self._cache_put(key, text)
+        return text
+    
+    async def generate_many(self, prompts: List[Tuple[str, str]], temperature: float = 0) -> List[str]:
+        """Generate for several (system_prompt, user_prompt) pairs concurrently
         
+        Ollama only overlaps the requests when started with OLLAMA_NUM_PARALLEL
+        set (e.g. OLLAMA_NUM_PARALLEL=8); otherwise they queue server-side.
+        """
+        return await asyncio.gather(*(
+            self.agenerate(system_prompt, user_prompt, temperature)
+            for system_prompt, user_prompt in prompts
+        ))
+    
+    def close(self):
+        """Save pending cache entries and release the pooled HTTP connections"""
+        self.flush_cache()
+        self.session.close()
+        client, loop = self._async_client, self._async_loop
+        self._async_client = self._async_loop = None
+        if client is None or loop.is_closed():
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            loop.run_until_complete(client.aclose())
+    
+    async def aclose(self):
+        """Close the pooled async client"""
+        client, loop = self._async_client, self._async_loop
+        self._async_client = self._async_loop = None
+        if client is not None and loop is asyncio.get_running_loop():
+            await client.aclose()
+
+
+class LLMDispatcher:
+    """Async front for LocalLLMInterface that coalesces duplicate prompts
+    
+    Concurrent submits of the same prompt share one Ollama call. Distinct
+    prompts are collected for a short window and dispatched concurrently,
+    at most max_parallel at a time (match OLLAMA_NUM_PARALLEL).
+    """
+    
+    def __init__(self, llm: LocalLLMInterface, window: float = 0.005, max_parallel: Optional[int] = None):
+        self.llm = llm
+        self.window = window
+        self.max_parallel = max_parallel or int(os.environ.get('OLLAMA_NUM_PARALLEL', 4))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        # Strong references to running dispatches; the loop only keeps weak ones
+        self._tasks: set = set()
+    
+    async def submit(self, system_prompt: str, user_prompt: str, temperature: float = 0,
+                     cache_key: Optional[str] = None) -> str:
+        """Generate a response, joining an identical request already in flight"""
+        key = (system_prompt, user_prompt, temperature, cache_key)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            self._ensure_worker()
+            await self._queue.put(key)
+        # Shield so one cancelled caller doesn't cancel the shared call
+        return await asyncio.shield(future)
+    
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_parallel)
+            self._worker = asyncio.create_task(self._collect())
+    
+    async def _collect(self):
+        """Pull requests in short windows and fan each distinct prompt out"""
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.window
+                while len(batch) < self.max_parallel:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                for key in batch:
+                    task = asyncio.create_task(self._dispatch(key))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                batch = []
+        except asyncio.CancelledError:
+            # Requests collected or still queued will never be dispatched
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for key in batch:
+                self._fail(key, RuntimeError("LLM dispatcher closed before the request was sent"))
+            raise
+    
+    def _fail(self, key: Tuple, error: BaseException):
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_exception(error)
+    
+    async def _dispatch(self, key: Tuple):
+        future = self._inflight[key]
+        try:
+            async with self._slots:
+                result = await self.llm.agenerate(*key)
+            if not future.done():
+                future.set_result(result)
+        except asyncio.CancelledError:
+            if not future.done():
+                future.set_exception(RuntimeError("LLM dispatcher closed during the request"))
+            raise
         except Exception as e:
-            return f"ERROR: Failed to connect to Ollama API: {str(e)}"
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self._inflight.pop(key, None)
+    
+    async def aclose(self):
+        """Stop the collector and any running dispatches, failing their waiters"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 # ============================================================================
 # RESPONSE FORMATTER
 # ============================================================================
 
+# Extended list of common fields worth showing from a result document
+_DISPLAY_KEYS = frozenset({
+    'name', 'title', 'email', 'username', 'product', 'status',
+    'value', 'amount', 'price', 'totalSales', 'orderCount',
+    'stock', 'inventory', 'quantity', 'category', 'role', 'city'
+})
+
+
+def _display_fields(doc: Dict) -> List[str]:
+    """'key: value' for display-worthy fields, walking nested documents depth-first in order"""
+    found = []
+    stack = [iter(doc.items())]
+    while stack:
+        for k, v in stack[-1]:
+            if isinstance(v, dict):
+                # Descend now; the parent's iterator resumes after the subdocument
+                stack.append(iter(v.items()))
+                break
+            if k in _DISPLAY_KEYS or 'name' in k.lower():
+                found.append(f"{k}: {v}")
+        else:
+            stack.pop()
+    return found
+
+
+# Aggregation summary keys containing one of these are shown as money
+_CURRENCY_HINTS = ('price', 'spending', 'amount')
+
+
+@lru_cache(maxsize=256)
+def _summary_key_format(key: str) -> Tuple[str, str]:
+    """(display title, numeric format) for an aggregation summary key
+    
+    Cached since the same few keys (total, totalSales, ...) come back on
+    every aggregation.
+    """
+    lowered = key.lower()
+    number = '${:,.2f}' if any(hint in lowered for hint in _CURRENCY_HINTS) else '{:,}'
+    return key.replace('_', ' ').title(), number
+
+
 class ResponseFormatter:
     """Format MongoDB query results into human-readable form"""
     
@@ -376,64 +1027,246 @@ class ResponseFormatter:
             return "No documents found matching your query."
         
         count = len(results)
-        response = f"Found {count} result{'s' if count != 1 else ''}:\n\n"
+        parts = [f"Found {count} result{'s' if count != 1 else ''}:\n\n"]
         # Format each result
         for i, doc in enumerate(results, 1):
             # Special handling for aggregation results (single result with calculated fields)
             if count == 1 and isinstance(doc, dict) and '_id' in doc and doc['_id'] is None:
                 # This is likely an aggregation result like { _id: null, total: 100 }
                 clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-                response = "Analysis Result:\n"
+                summary = ["Analysis Result:\n"]
                 for k, v in clean_doc.items():
+                    title, number = _summary_key_format(k)
                     # Format numbers nicely
                     if isinstance(v, (int, float)):
-                         if "price" in k.lower() or "spending" in k.lower() or "amount" in k.lower():
-                            response += f"• {k.replace('_', ' ').title()}: ${v:,.2f}\n"
-                         else:
-                            response += f"• {k.replace('_', ' ').title()}: {v:,}\n"
+                        summary.append(f"• {title}: {number.format(v)}\n")
                     else:
-                        response += f"• {k.replace('_', ' ').title()}: {v}\n"
-                return response
+                        summary.append(f"• {title}: {v}\n")
+                return ''.join(summary)
 
-            response += f"{i}. "
+            parts.append(f"{i}. ")
             
             if isinstance(doc, dict):
-                key_fields = []
-                # Extended list of common fields
-                display_keys = [
-                    'name', 'title', 'email', 'username', 'product', 'status', 
-                    'value', 'amount', 'price', 'totalSales', 'orderCount', 
-                    'stock', 'inventory', 'quantity', 'category', 'role', 'city'
-                ]
-                
-                # Helper to flatten and check keys
-                def extract_relevant(d, prefix=""):
-                    found = []
-                    for k, v in d.items():
-                        if isinstance(v, dict):
-                            found.extend(extract_relevant(v, prefix + k + "."))
-                        elif k in display_keys or (prefix + k) in display_keys or 'name' in k.lower():
-                             found.append(f"{k}: {v}")
-                    return found
-                
-                key_fields = extract_relevant(doc)
+                key_fields = _display_fields(doc)
                 
                 if key_fields:
-                    response += ", ".join(key_fields)
+                    parts.append(", ".join(key_fields))
                 else:
-                    response += str(doc)[:200]
+                    parts.append(str(doc)[:200])
             else:
-                response += str(doc)[:200]
+                parts.append(str(doc)[:200])
             
-            response += "\n"
+            parts.append("\n")
         
-        return response
+        return ''.join(parts)
 
 
 # ============================================================================
 # MAIN CHAT AGENT
 # ============================================================================
 
+# Question keywords, matched against the question's word tokens
+_WORD_RE = re.compile(r'[a-z0-9_]+')
+# Stems, so "dropping", "updated", "removal" etc. are refused as well
+_PROHIBITED_RE = re.compile(r'\b(?:drop|delet|updat|insert|modif|remov|truncat|alter)\w*')
+_ORDER_WORDS = frozenset({'order', 'orders'})
+_CUSTOMER_WORDS = frozenset({'customer', 'customers', 'user', 'users', 'client', 'clients'})
+_DETAIL_WORDS = frozenset({'name', 'names', 'email', 'emails', 'detail', 'details', 'info', 'information'})
+# In priority order when a question names more than one
+_STATUSES = ('completed', 'pending', 'cancelled')
+
+# "db.<collection>.<operation>(" anywhere in the model output
+_CMD_RE = re.compile(r'db\.([a-zA-Z0-9_]+)\.(find|aggregate|countDocuments|count)\(')
+# Bare JS object keys that need quoting before json.loads
+_UNQUOTED_KEY_RE = re.compile(r'([{\s,])([a-zA-Z_$][a-zA-Z0-9_$]*)\s*:')
+
+
+def _extract_balanced(text: str, open_ch: str, close_ch: str) -> Tuple[int, int]:
+    """Span of the first open_ch..close_ch group in text
+    
+    Returns (start, end) with end exclusive; start is -1 when open_ch is
+    absent and end is -1 when the group never closes.
+    """
+    start = text.find(open_ch)
+    if start == -1:
+        return -1, -1
+    
+    depth = 0
+    for i in range(start, len(text)):
+        char = text[i]
+        if char == open_ch:
+            depth += 1
+        elif char == close_ch:
+            depth -= 1
+            if not depth:
+                return start, i + 1
+    return start, -1
+
+
+def _parse_mongo_literal(text: str, array: bool = False):
+    """Parse the first {...} (or [...] when array=True) in LLM output
+    
+    Tries the key-quoted text as JSON, then the raw text as a Python
+    literal; returns an empty dict/list when neither works.
+    """
+    open_ch, close_ch = ('[', ']') if array else ('{', '}')
+    empty = [] if array else {}
+    
+    start, end = _extract_balanced(text, open_ch, close_ch)
+    if start == -1:
+        return empty
+    if end == -1:
+        # Unbalanced - take everything up to the last closer
+        end = text.rfind(close_ch) + 1
+        if end <= start:
+            return empty
+    literal = text[start:end]
+    
+    try:
+        return _json_loads(_UNQUOTED_KEY_RE.sub(r'\1"\2":', literal))
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        logger.warning("Parsing failed for %s: %s", 'pipeline' if array else 'query', literal)
+        return empty
+
+
+@lru_cache(maxsize=256)
+def _parse_mongo_call(query_code: str) -> Optional[Tuple[str, str, Any]]:
+    """Split LLM output into (collection, operation, payload)
+    
+    payload is the filter dict for find/count and the pipeline list for
+    aggregate; None when no db.<collection>.<operation>( call is found.
+    Memoized on the raw text, so callers must not mutate the payload.
+    """
+    match = _CMD_RE.search(query_code)
+    if not match:
+        return None
+    
+    collection_name, operation = match.group(1), match.group(2)
+    # Only the FIRST argument matters: for .find({...}).project({...}) we want the filter
+    payload = _parse_mongo_literal(query_code[match.end():], array=operation == 'aggregate')
+    return collection_name, operation, payload
+
+
+def _top_customers_pipeline(limit: int) -> List[Dict]:
+    """Completed-order spend per customer, joined to the customer's name/email
+    
+    Output keys are ones ResponseFormatter already displays.
+    """
+    return [
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": "$customerId", "amount": {"$sum": "$amount"}, "orderCount": {"$sum": 1}}},
+        {"$sort": {"amount": -1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "customers",
+            "let": {"cid": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$cid"]}}},
+                {"$project": {"name": 1, "email": 1, "_id": 0}}
+            ],
+            "as": "customer_info"
+        }},
+        {"$unwind": {"path": "$customer_info", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": 0,
+            "name": "$customer_info.name",
+            "email": "$customer_info.email",
+            "amount": 1,
+            "orderCount": 1
+        }}
+    ]
+
+
+# Questions common enough to answer without the LLM:
+# (pattern, match -> {collection: required fields}, match -> (collection, 'aggregate' | 'count', pipeline | filter)).
+# Patterns must match the whole normalized question so that qualifiers such as
+# "this year" or "in Delhi" still go to the model; templates whose collections or
+# fields are missing from the schema are skipped for the same reason.
+_LEAD_IN = r"(?:(?:what(?:'s| is| are)|show(?: me)?|get|give me|tell me)\s+)?(?:the\s+|our\s+)?"
+_TEMPLATES = [
+    (re.compile(_LEAD_IN + r"total\s+(?:sales|revenue)"),
+     lambda m: {'orders': ('amount', 'status')},
+     lambda m: ('orders', 'aggregate', [
+         {"$match": {"status": "completed"}},
+         {"$group": {"_id": None, "total_amount": {"$sum": "$amount"}, "order_count": {"$sum": 1}}}
+     ])),
+    (re.compile(_LEAD_IN + r"top\s+([1-9]\d*)\s+customers\s+by\s+(?:spending|spend|revenue|sales)"),
+     lambda m: {'orders': ('amount', 'status', 'customerId'), 'customers': ('name', 'email')},
+     lambda m: ('orders', 'aggregate', _top_customers_pipeline(int(m.group(1))))),
+    (re.compile(r"(?:how\s+many|(?:total\s+)?(?:count|number)\s+of)\s+(completed|pending|cancelled)\s+orders"
+                r"(?:\s+(?:are\s+there|do\s+we\s+have))?"),
+     lambda m: {'orders': ('status',)},
+     lambda m: ('orders', 'count', {"status": m.group(1)})),
+    (re.compile(r"(?:how\s+many|(?:total\s+)?(?:count|number)\s+of)\s+"
+                r"(orders|customers|products|users|payments|categories)"
+                r"(?:\s+(?:are\s+there|do\s+we\s+have))?"),
+     lambda m: {m.group(1): ()},
+     lambda m: (m.group(1), 'count', {})),
+]
+
+
+def _schema_has(schema_fields: Dict[str, frozenset], needs: Dict[str, Tuple[str, ...]]) -> bool:
+    """True when every named collection exists with all of its listed fields"""
+    return all(
+        collection in schema_fields and schema_fields[collection].issuperset(fields)
+        for collection, fields in needs.items()
+    )
+
+
+def _match_template(question: str, schema_fields: Dict[str, frozenset]) -> Optional[Tuple[str, str, Any]]:
+    """(collection, operation, payload) for a templated question the schema supports, else None
+    
+    schema_fields maps collection name -> field names.
+    """
+    normalized = question.strip().lower().rstrip('?.! ')
+    for pattern, needs, build in _TEMPLATES:
+        match = pattern.fullmatch(normalized)
+        if match:
+            return build(match) if _schema_has(schema_fields, needs(match)) else None
+    return None
+
+
+def _bounded(pipeline):
+    """pipeline with a trailing $limit 10 unless it already limits itself
+    
+    Returns a new list, since parsed pipelines are shared through the
+    _parse_mongo_call cache.
+    """
+    if isinstance(pipeline, list) and not any('$limit' in stage for stage in pipeline):
+        return pipeline + [{'$limit': 10}]
+    return pipeline
+
+
+def _schema_hash(schema: Dict) -> str:
+    """Short hash of the schema's structure: collection and stable field names
+    
+    Document counts, sampled fields/types and indexes are left out; they
+    drift on a live database and would rebuild the embeddings every start.
+    """
+    structure = {name: info.get('field_names') or sorted(info['fields']) for name, info in schema.items()}
+    encoded = json.dumps(structure, sort_keys=True).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+_EMBEDDINGS_CACHE_RE = re.compile(r'embeddings_[0-9a-f]{16}\.(?:npy|json)')
+
+
+def _remove_stale_embeddings(keep_path: str):
+    """Delete embeddings_<hash> caches left behind by earlier schemas"""
+    directory = os.path.dirname(keep_path) or '.'
+    keep = os.path.splitext(os.path.basename(keep_path))[0]
+    for entry in os.listdir(directory):
+        if _EMBEDDINGS_CACHE_RE.fullmatch(entry) and os.path.splitext(entry)[0] != keep:
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError as e:
+                print(f"Warning: Could not remove stale embeddings cache {entry}: {e}")
+
+
 class MongoDBChatAgent:
     """Main chat agent - handles user queries end-to-end"""
     
@@ -443,74 +1276,136 @@ class MongoDBChatAgent:
         # Initialize components
         self.db_connector = MongoDBConnector(mongodb_uri)
         self.vector_search = VectorSearchEngine()
-        self.llm = LocalLLMInterface()
+        self.llm = LocalLLMInterface(cache_path='llm_cache.json')
+        # Model load takes seconds; overlap it with schema extraction and embeddings
+        threading.Thread(target=self.llm.warmup, daemon=True).start()
+        # For async front ends; created lazily on the caller's event loop
+        self.llm_dispatcher = LLMDispatcher(self.llm)
         self.formatter = ResponseFormatter()
         
         # Connect to MongoDB
         if not self.db_connector.connect(db_name):
             print("Warning: Failed to connect to MongoDB")
-        
-        # Try Loading Embeddings first
-        if not self.vector_search.load_embeddings('embeddings.pkl'):
-            schema = self.db_connector.extract_schema()
-            self.embeddings = self.vector_search.generate_embeddings(schema)
-            self.vector_search.save_embeddings('embeddings.pkl')
         else:
+            self.db_connector.ensure_join_indexes()
+        
+        # Embeddings are cached under a hash of the schema they were built from,
+        # so a schema change gets fresh vectors and an unchanged one loads via mmap
+        connected = self.db_connector.db is not None
+        schema = self.db_connector.extract_schema() if connected else {}
+        self.schema_hash = _schema_hash(schema)
+        cache_path = f"embeddings_{self.schema_hash}.npy"
+        if connected and self.vector_search.load_embeddings(cache_path):
             self.embeddings = self.vector_search.embeddings_db
+        else:
+            self.embeddings = self.vector_search.generate_embeddings(schema)
+            # Without a database the schema is empty; leave the real caches alone
+            if connected:
+                self.vector_search.save_embeddings(cache_path)
+                _remove_stale_embeddings(cache_path)
             
-        self.prompt_builder = PromptBuilder(self.embeddings, self.db_connector)
+        self.prompt_builder = PromptBuilder(self.embeddings, self.db_connector, self.vector_search)
+        # collection -> field names, for checking templates against the real schema
+        self._schema_fields = {name: frozenset(info['field_names']) for name, info in schema.items()}
         
     
+    def _template_query(self, user_question: str, tokens: frozenset) -> Optional[Tuple[str, str, Any]]:
+        """(collection, operation, payload) when the question can skip the LLM, else None"""
+        # SMART JOIN DETECTION: Handle common cross-table queries with templates
+        # Pattern: Orders with Customer info, when asking for customer details
+        if (tokens & _ORDER_WORDS and tokens & _CUSTOMER_WORDS and tokens & _DETAIL_WORDS
+                and _schema_has(self._schema_fields, {'orders': ('customerId',), 'customers': ('name', 'email')})):
+            # Build join query automatically
+            match_filter = {}
+            status = next((status for status in _STATUSES if status in tokens), None)
+            if status:
+                if not _schema_has(self._schema_fields, {'orders': ('status',)}):
+                    return None
+                match_filter['status'] = status
+            
+            pipeline = [
+                {"$match": match_filter} if match_filter else {"$match": {}},
+                # Pin the 10 orders to _id order (index-backed); the lookup matches the
+                # unique customers._id and the unwind keeps unmatched orders, so each order
+                # yields exactly one row and limiting before the join returns the same rows
+                {"$sort": {"_id": 1}},
+                {"$limit": 10},
+                # Fetch only the customer fields the projection below uses
+                {"$lookup": {
+                    "from": "customers",
+                    "let": {"cid": "$customerId"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$_id", "$$cid"]}}},
+                        {"$project": {"name": 1, "email": 1, "_id": 0}}
+                    ],
+                    "as": "customer_info"
+                }},
+                {"$unwind": {"path": "$customer_info", "preserveNullAndEmptyArrays": True}},
+                {"$project": {
+                    "_id": 0,
+                    "status": 1,
+                    "amount": 1,
+                    "quantity": 1,
+                    "customer_name": "$customer_info.name",
+                    "customer_email": "$customer_info.email"
+                }}
+            ]
+            return 'orders', 'aggregate', pipeline
+        
+        # Fixed analytical questions run a ready-made pipeline instead of the LLM
+        return _match_template(user_question, self._schema_fields)
+    
+    def _llm_cache_key(self, user_question: str, system_prompt: str) -> str:
+        """Cache identity for a question's generated query
+        
+        The user prompt embeds sampled field values that change between
+        sessions, so the key is the question and schema plus the prompt
+        version and system prompt; editing either invalidates saved answers.
+        """
+        prompt_digest = hashlib.blake2b(system_prompt.encode(), digest_size=8).hexdigest()
+        question = ' '.join(user_question.lower().split())
+        return f"{PromptBuilder.PROMPT_VERSION}\0{prompt_digest}\0{self.schema_hash}\0{question}"
+    
+    def _check_model_output(self, query_code: str) -> Optional[str]:
+        """User-facing message when the model returned an error or refusal"""
+        if "ERROR:" in query_code:
+            return f"⚠ {query_code}"
+        
+        if "UNABLE_TO_QUERY" in query_code:
+            return "⚠ I cannot construct a valid query for this question with the available schema."
+        
+        if "MODIFICATION_NOT_ALLOWED" in query_code:
+            return "❌ Database modification is not allowed. This system is read-only."
+        
+        if "OUT_OF_SCOPE" in query_code:
+            return "❌ This question is not related to the database."
+        
+        return None
+    
     def process_query(self, user_question: str) -> str:
         """Process user query and return answer"""
         
+        question_lower = user_question.lower()
+        tokens = frozenset(_WORD_RE.findall(question_lower))
+        
         # Check for prohibited operations
-        prohibited_words = ['drop', 'delete', 'update', 'insert', 'modify', 'remove', 'truncate', 'alter']
-        if any(word in user_question.lower() for word in prohibited_words):
+        if _PROHIBITED_RE.search(question_lower):
             return "❌ Database modification queries are not allowed. You can only view/query data."
         
-        # SMART JOIN DETECTION: Handle common cross-table queries with templates
-        question_lower = user_question.lower()
-        
-        # Pattern: Orders with Customer info
-        if ('order' in question_lower and any(word in question_lower for word in ['customer', 'user', 'client'])):
-            # Check if asking for customer details
-            if any(word in question_lower for word in ['name', 'email', 'detail', 'info']):
-                # Build join query automatically
-                match_filter = {}
-                if 'completed' in question_lower:
-                    match_filter['status'] = 'completed'
-                elif 'pending' in question_lower:
-                    match_filter['status'] = 'pending'
-                elif 'cancelled' in question_lower:
-                    match_filter['status'] = 'cancelled'
-                
-                pipeline = [
-                    {"$match": match_filter} if match_filter else {"$match": {}},
-                    {"$lookup": {
-                        "from": "customers",
-                        "localField": "customerId",
-                        "foreignField": "_id",
-                        "as": "customer_info"
-                    }},
-                    {"$unwind": {"path": "$customer_info", "preserveNullAndEmptyArrays": True}},
-                    {"$project": {
-                        "_id": 0,
-                        "status": 1,
-                        "amount": 1,
-                        "quantity": 1,
-                        "customer_name": "$customer_info.name",
-                        "customer_email": "$customer_info.email"
-                    }},
-                    {"$limit": 10}
-                ]
-                
-                try:
-                    results = list(self.db_connector.db['orders'].aggregate(pipeline))
-                    return self.formatter.format_results(results, user_question)
-                except Exception as e:
-                    # Fall through to LLM if template fails
-                    print(f"Template join failed: {e}, falling back to LLM")
+        template = self._template_query(user_question, tokens)
+        if template:
+            collection_name, operation, payload = template
+            try:
+                if operation == 'count':
+                    # Shown as a one-line summary, including zero
+                    count = self.db_connector.count_documents(collection_name, payload)
+                    results = [{"_id": None, "count": count}]
+                else:
+                    results = list(self.db_connector.db[collection_name].aggregate(payload))
+                return self.formatter.format_results(results, user_question)
+            except Exception as e:
+                # Fall through to LLM if template fails
+                logger.warning("Template query failed: %s, falling back to LLM", e)
         
         # Build prompt with relevant schema
         system_prompt, user_prompt = self.prompt_builder.get_reliable_prompt(user_question)
@@ -520,155 +1415,42 @@ class MongoDBChatAgent:
             return "❌ This question is not related to the database. Please ask something about the data in MongoDB."
         
         # Get query from Qwen2.5
-        query_code = self.llm.generate(system_prompt, user_prompt, temperature=0)
+        query_code = self.llm.generate(system_prompt, user_prompt, temperature=0,
+                                       cache_key=self._llm_cache_key(user_question, system_prompt))
         
-        # DEBUG: Print query to terminal
-        print(f"\n🔹 MODEL OUTPUT:\n{query_code}\n")
+        # DEBUG: Log the raw query
+        logger.debug("MODEL OUTPUT:\n%s", query_code)
         
         # Check for errors
-        if "ERROR:" in query_code:
-            return f"⚠ {query_code}"
-        
-        if "UNABLE_TO_QUERY" in query_code:
-            return "⚠ I cannot construct a valid query for this question with the available schema."
-        
-        if "MODIFICATION_NOT_ALLOWED" in query_code:
-            return "❌ Database modification is not allowed. This system is read-only."
-        
-        if "OUT_OF_SCOPE" in query_code:
-            return "❌ This question is not related to the database."
+        message = self._check_model_output(query_code)
+        if message:
+            return message
         
         # Parse the MongoDB query
         query_code = query_code.strip()
-        
-        # Parse collection name and query
         results = []
         try:
-            # Regex finds "db.<collection>.<find|aggregate|countDocuments|count>(" matching ignoring leading text
-            import re
-            match = re.search(r'db\.([a-zA-Z0-9_]+)\.(find|aggregate|countDocuments|count)\(', query_code)
+            # Model output can defeat the literal parsers in odd ways; report, don't raise
+            parsed = _parse_mongo_call(query_code)
+            if parsed is None:
+                return f"⚠ Could not identify MongoDB command (find/aggregate/countDocuments) in response:\n{query_code}"
+            collection_name, operation, payload = parsed
             
-            if match:
-                collection_name = match.group(1)
-                operation = match.group(2)
-                # Content starts immediately after the opening parenthesis
-                content_after_op = query_code[match.end():]
-                
-                if operation in ['find', 'countDocuments', 'count']:
-                    # Extract query object {...}
-                    query_dict = {}
-                    if '{' in content_after_op:
-                        start = content_after_op.find('{')
-                        # Heuristic: Find balanced braces or just take the main object
-                        # This simple heuristic grabs the first object passed to find()
-                        # If the LLM generates .find({...}).project({...}), we mainly care about the filter first.
-                        # Advanced parsing would needed for projection.
-                        
-                        # Use a brace counter to find the matching closing brace for the FIRST argument
-                        stack = []
-                        end = -1
-                        for i, char in enumerate(content_after_op[start:]):
-                            if char == '{':
-                                stack.append('{')
-                            elif char == '}':
-                                stack.pop()
-                                if not stack:
-                                    end = start + i + 1
-                                    break
-                        
-                        if end != -1:
-                            query_str = content_after_op[start:end]
-                            
-                            # Fix unquoted keys
-                            clean_query_str = re.sub(r'([{\s,])([a-zA-Z_$][a-zA-Z0-9_$]*)\s*:', r'\1"\2":', query_str)
-                            
-                            try:
-                                query_dict = json.loads(clean_query_str)
-                            except:
-                                try:
-                                    query_dict = json.loads(query_str)
-                                except (ValueError, SyntaxError):
-                                    try:
-                                        import ast
-                                        query_dict = ast.literal_eval(query_str)
-                                    except:
-                                        print(f"⚠ Parsing failed for query: {query_str}")
-                                        query_dict = {} 
-                        else:
-                             # Fallback if brace counting fails
-                             end = content_after_op.rfind('}') + 1
-                             query_str = content_after_op[start:end]
-                             # (clean logic repeated or shared function)
-                             clean_query_str = re.sub(r'([{\s,])([a-zA-Z_$][a-zA-Z0-9_$]*)\s*:', r'\1"\2":', query_str)
-                             try:
-                                query_dict = json.loads(clean_query_str)
-                             except: 
-                                query_dict = {} 
-                    
-                    if operation == 'find':
-                        results = self.db_connector.execute_query(collection_name, query_dict)
-                    else:
-                        # countDocuments/count logic
-                        try:
-                            count = self.db_connector.db[collection_name].count_documents(query_dict)
-                            results = [{"count": count, "description": f"Total documents in {collection_name} matching query"}]
-                        except Exception as e:
-                            return f"❌ Error counting documents: {str(e)}"
-                
-                elif operation == 'aggregate':
-                    # Extract pipeline [...]
-                    pipeline = []
-                    if '[' in content_after_op:
-                        start = content_after_op.find('[')
-                        
-                        # Use a bracket counter to find the matching closing bracket for the array
-                        stack = []
-                        end = -1
-                        for i, char in enumerate(content_after_op[start:]):
-                            if char == '[':
-                                stack.append('[')
-                            elif char == ']':
-                                stack.pop()
-                                if not stack:
-                                    end = start + i + 1
-                                    break
-                        
-                        if end != -1:
-                            pipeline_str = content_after_op[start:end]
-                            
-                            # Fix unquoted keys for pipeline
-                            clean_pipeline_str = re.sub(r'([{\s,])([a-zA-Z_$][a-zA-Z0-9_$]*)\s*:', r'\1"\2":', pipeline_str)
-    
-                            try:
-                                # Try clean version
-                                pipeline = json.loads(clean_pipeline_str)
-                            except:
-                                try:
-                                    # Try original
-                                    pipeline = json.loads(pipeline_str)
-                                except (ValueError, SyntaxError):
-                                    try:
-                                        import ast
-                                        pipeline = ast.literal_eval(pipeline_str)
-                                    except:
-                                        print(f"⚠ Parsing failed for pipeline: {pipeline_str}")
-                                        pipeline = [] 
-                        else:
-                            # Fallback
-                            end = content_after_op.rfind(']') + 1
-                            pipeline_str = content_after_op[start:end]
-                            # (repeat clean logic)
-                            clean_pipeline_str = re.sub(r'([{\s,])([a-zA-Z_$][a-zA-Z0-9_$]*)\s*:', r'\1"\2":', pipeline_str)
-                            try:
-                                pipeline = json.loads(clean_pipeline_str)
-                            except:
-                                pipeline = []
-
-                    # Execute aggregate
-                    results = list(self.db_connector.db[collection_name].aggregate(pipeline))[:10]
+            if operation == 'find':
+                results = self.db_connector.execute_query(collection_name, payload)
+            
+            elif operation == 'aggregate':
+                # Bound the work server-side and stop reading after 10 documents
+                cursor = self.db_connector.db[collection_name].aggregate(_bounded(payload), batchSize=10)
+                results = list(islice(cursor, 10))
             
             else:
-                return f"⚠ Could not identify MongoDB command (find/aggregate/countDocuments) in response:\n{query_code}"
+                # countDocuments/count logic
+                try:
+                    count = self.db_connector.count_documents(collection_name, payload)
+                    results = [{"count": count, "description": f"Total documents in {collection_name} matching query"}]
+                except Exception as e:
+                    return f"❌ Error counting documents: {str(e)}"
         
         except Exception as e:
             return f"❌ Query execution error: {str(e)}\n\nGenerated query:\n{query_code}"
@@ -676,4 +1458,83 @@ class MongoDBChatAgent:
         # Format results
         formatted_response = self.formatter.format_results(results, user_question)
         
-        return formatted_response
\ No newline at end of file
+        return formatted_response
+    
+    async def aprocess_query(self, user_question: str) -> str:
+        """process_query for event loops: Ollama and MongoDB calls are awaited
+        
+        With motor installed the database round trips overlap other questions'
+        LLM calls; without it they run in worker threads.
+        """
+        question_lower = user_question.lower()
+        tokens = frozenset(_WORD_RE.findall(question_lower))
+        
+        if _PROHIBITED_RE.search(question_lower):
+            return "❌ Database modification queries are not allowed. You can only view/query data."
+        
+        template = self._template_query(user_question, tokens)
+        if template:
+            collection_name, operation, payload = template
+            try:
+                if operation == 'count':
+                    count = await self.db_connector.acount_documents(collection_name, payload)
+                    results = [{"_id": None, "count": count}]
+                else:
+                    results = await self.db_connector.aaggregate(collection_name, payload, limit=None)
+                return self.formatter.format_results(results, user_question)
+            except Exception as e:
+                logger.warning("Template query failed: %s, falling back to LLM", e)
+        
+        # Embedding the question is CPU work; keep it off the loop (torch releases
+        # the GIL during encode, so concurrent questions embed in parallel)
+        system_prompt, user_prompt = await asyncio.to_thread(self.prompt_builder.get_reliable_prompt, user_question)
+        
+        if "OUT_OF_SCOPE" in system_prompt or "OUT_OF_SCOPE" in user_prompt:
+            return "❌ This question is not related to the database. Please ask something about the data in MongoDB."
+        
+        query_code = await self.llm_dispatcher.submit(system_prompt, user_prompt, temperature=0,
+                                                      cache_key=self._llm_cache_key(user_question, system_prompt))
+        
+        logger.debug("MODEL OUTPUT:\n%s", query_code)
+        
+        message = self._check_model_output(query_code)
+        if message:
+            return message
+        
+        query_code = query_code.strip()
+        try:
+            # Model output can defeat the literal parsers in odd ways; report, don't raise
+            parsed = _parse_mongo_call(query_code)
+            if parsed is None:
+                return f"⚠ Could not identify MongoDB command (find/aggregate/countDocuments) in response:\n{query_code}"
+            collection_name, operation, payload = parsed
+            
+            if operation == 'find':
+                results = await self.db_connector.aexecute_query(collection_name, payload)
+            
+            elif operation == 'aggregate':
+                results = await self.db_connector.aaggregate(collection_name, _bounded(payload))
+            
+            else:
+                try:
+                    count = await self.db_connector.acount_documents(collection_name, payload)
+                    results = [{"count": count, "description": f"Total documents in {collection_name} matching query"}]
+                except Exception as e:
+                    return f"❌ Error counting documents: {str(e)}"
+        
+        except Exception as e:
+            return f"❌ Query execution error: {str(e)}\n\nGenerated query:\n{query_code}"
+        
+        return self.formatter.format_results(results, user_question)
+    
+    def close(self):
+        """Release the connection pools (the LLM cache is saved as it fills)"""
+        self.llm.close()
+        if self.db_connector.client is not None:
+            self.db_connector.client.close()
+        if self.db_connector.async_client is not None:
+            self.db_connector.async_client.close()
+    
+    async def process_queries(self, user_questions: List[str]) -> List[str]:
+        """Answer several questions concurrently, overlapping their LLM round trips"""
+        return await asyncio.gather(*(self.aprocess_query(question) for question in user_questions))
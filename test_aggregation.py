@@ -1,6 +1,4 @@
 from pymongo import MongoClient
-from bson import json_util
-import json
 
 client = MongoClient('mongodb://localhost:27017')
 db = client['ai_test_db']
@@ -17,7 +15,7 @@ print("Results:", results)
 
 # Test the query generator output
 from dynamic_query_generator import generate_mongo_query
-from dynamic_query_executor import execute_mongo_query
+from dynamic_query_executor import execute_mongo_query, parse_query
 
 print("\nTesting query generator...")
 question = "total sales"
@@ -25,7 +23,7 @@ query_str = generate_mongo_query(question)
 print("Generated query:", query_str)
 
 # Parse and execute
-query_data = json.loads(query_str, object_hook=json_util.object_hook)
+query_data = parse_query(query_str)
 print("Parsed query:", query_data)
 
 results = list(db.orders.aggregate(query_data))
@@ -0,0 +1,26 @@
+"""Shared setup for the offline unit tests
+
+The modules under test import their heavy or connected dependencies at
+import time; these stand-ins let the pure helpers be tested without a
+running MongoDB or a downloaded embedding model.
+"""
+
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import sentence_transformers  # noqa: F401
+except ImportError:
+    sys.modules['sentence_transformers'] = types.SimpleNamespace(SentenceTransformer=object)
+
+# dynamic_query_generator reads the schema from metadata_provider on import
+SCHEMA = {
+    'orders': {'fields': {'customerId': 'object', 'productId': 'object', 'amount': 'number',
+                          'quantity': 'number', 'status': 'string', 'orderDate': 'date'}},
+    'customers': {'fields': {'name': 'string', 'email': 'string', 'city': 'string', 'createdAt': 'date'}},
+    'products': {'fields': {'name': 'string', 'price': 'number', 'stock': 'number'}},
+}
+sys.modules['metadata_provider'] = types.SimpleNamespace(extract_metadata=lambda *args, **kwargs: SCHEMA)
@@ -0,0 +1,185 @@
+"""Formatter output regressions: the rewritten formatters must render results exactly as before"""
+
+import pytest
+
+from enhanced_response_formatter import enhanced_formatter
+from intelligent_response_formatter import intelligent_formatter
+
+PRODUCTS = [
+    {'productName': f'P{n}', 'totalSales': n * 10.5, 'quantitySold': n * 1000, 'orderCount': n}
+    for n in (3, 2, 1)
+]
+CITIES = [
+    {'city': 'Delhi', 'totalSales': 750, 'orderCount': 1000, 'customerCount': 20},
+    {'city': 'Pune', 'totalSales': 250, 'orderCount': 3, 'customerCount': 0},
+]
+
+INTELLIGENT_CASES = [
+    ('worst products', PRODUCTS,
+     ('📉 **Worst Performing Products**\n'
+      '\n'
+      '1. **P3**\n'
+      '   💰 Sales: $31.50\n'
+      '   📦 Units sold: 3,000\n'
+      '   🛒 Orders: 3\n'
+      '\n'
+      '2. **P2**\n'
+      '   💰 Sales: $21.00\n'
+      '   📦 Units sold: 2,000\n'
+      '   🛒 Orders: 2\n'
+      '\n'
+      '3. **P1**\n'
+      '   💰 Sales: $10.50\n'
+      '   📦 Units sold: 1,000\n'
+      '   🛒 Orders: 1\n'
+      '\n')),
+    ('top customers',
+     [{'customerName': 'Asha', 'totalSales': 5, 'totalSpent': 1299.999, 'orderCount': 4, 'avgOrderValue': 325.25}],
+     ('👑 **Top Value Customers**\n'
+      '\n'
+      '1. **Asha** (Unknown)\n'
+      '   💰 Total spent: $1,300.00\n'
+      '   🛒 Orders: 4 (avg: $325.25)\n'
+      '\n')),
+    ('sales by month',
+     [{'monthName': month, 'year': 2024, 'totalSales': sales, 'orderCount': orders, 'avgOrderValue': 3.3}
+      for month, sales, orders in [('Jan', 100.5, 3), ('Feb', 3000, 10), ('Mar', 50, 1)]],
+     ('📅 **Seasonal Sales Analysis**\n'
+      '\n'
+      '📊 **Jan 2024**\n'
+      '   💰 Sales: $100.50 (3.2% of total)\n'
+      '   🛒 Orders: 3 (avg: $3.30)\n'
+      '\n'
+      '📊 **Feb 2024**\n'
+      '   💰 Sales: $3,000.00 (95.2% of total)\n'
+      '   🛒 Orders: 10 (avg: $3.30)\n'
+      '\n'
+      '📊 **Mar 2024**\n'
+      '   💰 Sales: $50.00 (1.6% of total)\n'
+      '   🛒 Orders: 1 (avg: $3.30)\n'
+      '\n'
+      '🏆 **Best month:** Feb ($3,000.00)\n'
+      '📉 **Slowest month:** Mar ($50.00)\n')),
+    ('sales by city', CITIES,
+     ('🗺️ **Sales by Location**\n'
+      '\n'
+      '1. **Delhi**\n'
+      '   💰 Sales: $750.00 (75.0%)\n'
+      '   🛒 Orders: 1,000\n'
+      '   👥 Customers: 20\n'
+      '\n'
+      '2. **Pune**\n'
+      '   💰 Sales: $250.00 (25.0%)\n'
+      '   🛒 Orders: 3\n'
+      '\n')),
+    ('sales in 2023', [{'totalSales': 600000, 'orderCount': 300}],
+     ('💰 **Sales Summary for 2023**\n'
+      '\n'
+      '**Total Revenue:** $600,000.00\n'
+      '**Total Orders:** 300\n'
+      '**Average Order Value:** $2000.00\n'
+      '\n'
+      '👍 Good performance! Strong revenue for 2023.')),
+    ('how many customers', [{'total': 1234}],
+     ('👥 **Customers Count**\n'
+      '\n'
+      'Total customers: **1,234**\n'
+      '\n'
+      '🎯 Great customer base! Consider segmentation strategies.')),
+    ('what is the revenue', [{'_id': None, 'sum': 1234.567}],
+     '💰 **Total Sales:** $1,234.57'),
+    ('list customers',
+     [{'name': 'Asha', 'email': 'a@x.in', 'city': 'Delhi'}, {'name': 'Ravi', 'email': 'r@x.in', 'city': 'Pune'}],
+     ('📋 **Results:**\n'
+      '\n'
+      '1. **Asha** - a@x.in (Delhi)\n'
+      '2. **Ravi** - r@x.in (Pune)\n')),
+    ('sales', [],
+     ('🔍 **No data found for your query.**\n'
+      '\n'
+      '💡 **Try these alternatives:**\n'
+      "• 'total sales' (all time)\n"
+      "• 'sales this year'\n"
+      "• 'sales by city'\n")),
+]
+
+
+@pytest.mark.parametrize("question, data, expected", INTELLIGENT_CASES, ids=[case[0] for case in INTELLIGENT_CASES])
+def test_intelligent_formatter_output(question, data, expected):
+    assert intelligent_formatter.format_intelligent_response(question, data) == expected
+
+
+@pytest.mark.parametrize("plural, singular, data", [
+    ('what are the revenues', 'what is the revenue', [{'_id': None, 'sum': 5}]),
+    ('order totals', 'order total', [{'total': 6000}]),
+    ('averages', 'average', [{'_id': None, 'value': 12.5}]),
+    ('no products found', 'no product found', []),
+])
+def test_intelligent_formatter_plural_keywords(plural, singular, data):
+    expected = intelligent_formatter.format_intelligent_response(singular, data)
+    assert intelligent_formatter.format_intelligent_response(plural, data) == expected
+
+
+ENHANCED_CASES = [
+    ('worst products', PRODUCTS,
+     ('📉 **Worst Performing Products**\n'
+      '\n'
+      '1. **P3**\n'
+      '   💰 Sales: $31.50 | 📦 Units: 3,000 | 🛒 Orders: 3\n'
+      '\n'
+      '2. **P2**\n'
+      '   💰 Sales: $21.00 | 📦 Units: 2,000 | 🛒 Orders: 2\n'
+      '\n'
+      '3. **P1**\n'
+      '   💰 Sales: $10.50 | 📦 Units: 1,000 | 🛒 Orders: 1\n'
+      '\n')),
+    ('best products', PRODUCTS[:1],
+     ('📈 **Top Performing Products**\n'
+      '\n'
+      '1. **P3**\n'
+      '   💰 Sales: $31.50 | 📦 Units: 3,000 | 🛒 Orders: 3\n'
+      '\n')),
+    ('seasonal sales',
+     [{'monthName': month, 'totalSales': sales, 'orderCount': orders}
+      for month, sales, orders in [('Jan', 100.5, 3), ('Feb', 3000, 10), ('Mar', 50, 1)]],
+     ('📅 **Seasonal Sales Analysis**\n'
+      '\n'
+      '📊 **Jan:** $100.50 (3.2% of total, 3 orders)\n'
+      '📊 **Feb:** $3,000.00 (95.2% of total, 10 orders)\n'
+      '📊 **Mar:** $50.00 (1.6% of total, 1 orders)\n'
+      '\n'
+      '🏆 **Best month:** Feb ($3,000.00)\n'
+      '📉 **Slowest month:** Mar ($50.00)')),
+    ('sales by city', CITIES,
+     ('🗺️ **Sales by Location**\n'
+      '\n'
+      '1. **Delhi** - $750.00 (75.0%)\n'
+      '   🛒 1,000 orders | 👥 20 customers\n'
+      '\n'
+      '2. **Pune** - $250.00 (25.0%)\n'
+      '   🛒 3 orders\n'
+      '\n')),
+    ('top customers',
+     [{'customerName': 'Asha', 'totalSpent': 1299.999, 'orderCount': 4, 'avgOrderValue': 325.25, 'customerCity': 'Delhi'}],
+     ('👑 **Top Value Customers**\n'
+      '\n'
+      '1. **Asha** (Delhi)\n'
+      '   💰 Spent: $1,300.00 | 🛒 Orders: 4 | 📊 Avg: $325.25\n'
+      '\n')),
+    ('how many orders', [{'total': 5001}],
+     '🛒 **Order Count:** 5,001 orders in the system'),
+]
+
+
+@pytest.mark.parametrize("question, data, expected", ENHANCED_CASES, ids=[case[0] for case in ENHANCED_CASES])
+def test_enhanced_formatter_output(question, data, expected):
+    assert enhanced_formatter.format_enhanced_response(question, data) == expected
+
+
+def test_enhanced_formatter_product_extremes():
+    facets = [{'top': PRODUCTS[:1], 'bottom': PRODUCTS[-1:]}]
+    # The headings come from the facet legs, not from the question's wording
+    assert enhanced_formatter.format_enhanced_response('worst products', facets) == (
+        enhanced_formatter.format_enhanced_response('best products', PRODUCTS[:1])
+        + enhanced_formatter.format_enhanced_response('worst products', PRODUCTS[-1:])
+    )
@@ -0,0 +1,48 @@
+"""Parsing of the db.<collection>.<operation>(...) call the LLM returns"""
+
+from mongo_chat_agent import _parse_mongo_call
+
+
+def test_find_with_json_filter():
+    assert _parse_mongo_call('db.orders.find({"status": "pending"})') == ('orders', 'find', {"status": "pending"})
+
+
+def test_unquoted_keys_and_operators():
+    code = 'db.orders.find({status: "completed", amount: {$gt: 100}})'
+    assert _parse_mongo_call(code) == ('orders', 'find', {"status": "completed", "amount": {"$gt": 100}})
+
+
+def test_aggregate_payload_is_the_pipeline():
+    code = 'db.orders.aggregate([{$match: {status: "completed"}}, {$group: {_id: "$customerId", n: {$sum: 1}}}])'
+    collection, operation, pipeline = _parse_mongo_call(code)
+    assert (collection, operation) == ('orders', 'aggregate')
+    assert pipeline == [
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": "$customerId", "n": {"$sum": 1}}},
+    ]
+
+
+def test_python_literal_fallback():
+    # Single quotes and None aren't JSON, so this goes through ast.literal_eval
+    code = "db.customers.find({'city': 'Delhi', 'deletedAt': None})"
+    assert _parse_mongo_call(code) == ('customers', 'find', {'city': 'Delhi', 'deletedAt': None})
+
+
+def test_only_the_first_argument_is_the_filter():
+    code = 'db.customers.find({"city": "Delhi"}).project({"name": 1})'
+    assert _parse_mongo_call(code) == ('customers', 'find', {"city": "Delhi"})
+
+
+def test_call_embedded_in_prose():
+    code = 'Here is the query:\n```\ndb.products.countDocuments({stock: {$lt: 5}})\n```'
+    assert _parse_mongo_call(code) == ('products', 'countDocuments', {"stock": {"$lt": 5}})
+
+
+def test_unparseable_payload_is_empty():
+    assert _parse_mongo_call('db.orders.find({status: pending})') == ('orders', 'find', {})
+    assert _parse_mongo_call('db.orders.aggregate()') == ('orders', 'aggregate', [])
+
+
+def test_no_call_found():
+    assert _parse_mongo_call('UNABLE_TO_QUERY') is None
+    assert _parse_mongo_call('orders.find({})') is None
@@ -0,0 +1,99 @@
+"""Pipeline rewriting and question analysis in dynamic_query_generator"""
+
+import pytest
+
+from dynamic_query_generator import _hoist_group_key_matches, _matched_intents, _top_intent, query_generator
+
+
+def test_group_key_match_moves_above_group():
+    pipeline = [
+        {"$group": {"_id": "$productId", "total": {"$sum": "$amount"}}},
+        {"$match": {"_id": {"$ne": None}}},
+    ]
+    assert _hoist_group_key_matches(pipeline) == [
+        {"$match": {"productId": {"$ne": None}}},
+        {"$group": {"_id": "$productId", "total": {"$sum": "$amount"}}},
+    ]
+
+
+def test_hoisted_predicate_merges_into_leading_match():
+    pipeline = [
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": "$productId", "total": {"$sum": "$amount"}}},
+        {"$match": {"_id": {"$ne": None}, "total": {"$gt": 100}}},
+    ]
+    assert _hoist_group_key_matches(pipeline) == [
+        {"$match": {"status": "completed", "productId": {"$ne": None}}},
+        {"$group": {"_id": "$productId", "total": {"$sum": "$amount"}}},
+        {"$match": {"total": {"$gt": 100}}},
+    ]
+
+
+def test_compound_group_key_maps_to_source_field():
+    pipeline = [
+        {"$group": {"_id": {"city": "$city", "year": {"$year": "$orderDate"}}, "n": {"$sum": 1}}},
+        {"$match": {"_id.city": "Delhi", "_id.year": 2024}},
+    ]
+    assert _hoist_group_key_matches(pipeline) == [
+        {"$match": {"city": "Delhi"}},
+        {"$group": {"_id": {"city": "$city", "year": {"$year": "$orderDate"}}, "n": {"$sum": 1}}},
+        # Computed keys have no source field to filter on
+        {"$match": {"_id.year": 2024}},
+    ]
+
+
+def test_conflicting_leading_match_is_not_merged():
+    pipeline = [
+        {"$match": {"productId": {"$exists": True}}},
+        {"$group": {"_id": "$productId", "n": {"$sum": 1}}},
+        {"$match": {"_id": {"$ne": None}}},
+    ]
+    assert _hoist_group_key_matches(pipeline) == [
+        {"$match": {"productId": {"$exists": True}}},
+        {"$match": {"productId": {"$ne": None}}},
+        {"$group": {"_id": "$productId", "n": {"$sum": 1}}},
+    ]
+
+
+def test_accumulator_match_stays_and_input_is_not_mutated():
+    pipeline = [
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+        {"$match": {"total": {"$gt": 0}}},
+    ]
+    original = [dict(stage) for stage in pipeline]
+    assert _hoist_group_key_matches(pipeline) == original
+    assert pipeline == original
+
+
+@pytest.mark.parametrize("question, sort_order", [
+    ("which product sold the most", -1),
+    ("worst selling products", 1),
+    ("top and bottom products", 1),
+])
+def test_product_rankings_lead_with_match(question, sort_order):
+    pipeline, collection = query_generator.generate_query(question)
+    assert collection == 'orders'
+    assert pipeline[0] == {"$match": {"status": "completed", "productId": {"$ne": None}}}
+    assert [next(iter(stage)) for stage in pipeline][:4] == ['$match', '$group', '$sort', '$limit']
+    assert pipeline[2] == {"$sort": {"totalSales": sort_order}}
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("discount summary", 'list'),
+    ("show the account details", 'list'),
+    ("count orders", 'count'),
+    ("how many customers", 'count'),
+    ("total sales count", 'aggregate_sum'),
+    ("worst products by total sales", 'min_analysis'),
+    ("best customers", 'max_analysis'),
+    ("average order amounts", 'average'),
+    ("list the highest prices", 'max_analysis'),
+])
+def test_intent_priority(question, intent):
+    assert _top_intent(_matched_intents(question)) == intent
+
+
+def test_keywords_tolerate_plurals_but_not_substrings():
+    assert _matched_intents("order counts") == {'count'}
+    assert _matched_intents("the totals") == {'aggregate_sum'}
+    assert _matched_intents("a discounted summary") == frozenset()
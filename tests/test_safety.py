@@ -0,0 +1,69 @@
+"""Read-only safeguards: forbidden query structures and modification requests"""
+
+import asyncio
+
+import pytest
+
+from mongo_chat_agent import MongoDBChatAgent, MongoDBConnector, _PROHIBITED_RE
+
+
+@pytest.fixture
+def connector():
+    # The structural check needs no connection
+    return object.__new__(MongoDBConnector)
+
+
+@pytest.mark.parametrize("query", [
+    {"$set": {"status": "completed"}},
+    {"status": "pending", "$Unset": {"amount": ""}},
+    [{"$match": {}}, {"$project": {"x": {"$inc": 1}}}],
+    {"$and": [{"status": "completed"}, {"$where": "db.orders.drop()"}]},
+    {"$or": [{"$where": "function () { db.orders.deleteMany({}); return true; }"}]},
+    {"$expr": {"$function": {"body": "function (a) { db.users.updateOne({}, {}); return a; }",
+                             "args": ["$amount"], "lang": "js"}}},
+    [{"$group": {"_id": None, "x": {"$accumulator": {"init": "function () { db.x.DROP(); }"}}}}],
+])
+def test_forbidden_structures(connector, query):
+    assert connector._has_forbidden(query)
+
+
+@pytest.mark.parametrize("query", [
+    {"status": "completed", "amount": {"$gt": 100}},
+    [{"$match": {"status": "completed"}}, {"$group": {"_id": "$customerId", "n": {"$sum": 1}}}],
+    {"$where": "this.amount > this.discount"},
+    # Data values that merely look like operators are not queries
+    {"note": "$set", "name": "drop(table)"},
+    {1: "numeric keys are fine"},
+])
+def test_allowed_structures(connector, query):
+    assert not connector._has_forbidden(query)
+
+
+@pytest.mark.parametrize("question", [
+    "drop the orders collection",
+    "Dropping all customers",
+    "delete pending orders",
+    "which orders were deleted",
+    "update the prices",
+    "list updated orders",
+    "insert a new product",
+    "modify customer emails",
+    "remove cancelled orders",
+    "truncate products",
+    "ALTER the schema",
+])
+def test_modification_questions_are_refused(question):
+    # Refused before any template, prompt or LLM work, so the agent needs no setup
+    agent = object.__new__(MongoDBChatAgent)
+    assert agent.process_query(question).startswith("❌ Database modification")
+    assert asyncio.run(agent.aprocess_query(question)).startswith("❌ Database modification")
+
+
+@pytest.mark.parametrize("question", [
+    "total sales",
+    "customers with no orders",
+    "products with a discount",
+    "orders from Androp",
+])
+def test_read_questions_pass_the_word_filter(question):
+    assert not _PROHIBITED_RE.search(question.lower())
@@ -0,0 +1,84 @@
+"""Template answers that bypass the LLM in mongo_chat_agent"""
+
+import pytest
+
+from mongo_chat_agent import MongoDBChatAgent, _WORD_RE, _match_template
+
+FULL_SCHEMA = {
+    'orders': frozenset({'customerId', 'amount', 'status', 'quantity'}),
+    'customers': frozenset({'name', 'email'}),
+    'products': frozenset({'name', 'price'}),
+}
+
+
+def _stages(pipeline):
+    return [next(iter(stage)) for stage in pipeline]
+
+
+def _agent(schema_fields):
+    agent = object.__new__(MongoDBChatAgent)
+    agent._schema_fields = schema_fields
+    return agent
+
+
+def _template_query(agent, question):
+    return agent._template_query(question, frozenset(_WORD_RE.findall(question.lower())))
+
+
+def test_total_sales_template():
+    collection, operation, pipeline = _match_template("What is the total revenue?", FULL_SCHEMA)
+    assert (collection, operation) == ('orders', 'aggregate')
+    assert pipeline[0] == {"$match": {"status": "completed"}}
+    assert _stages(pipeline) == ['$match', '$group']
+
+
+def test_top_customers_template_uses_requested_limit():
+    collection, operation, pipeline = _match_template("top 5 customers by spending", FULL_SCHEMA)
+    assert (collection, operation) == ('orders', 'aggregate')
+    assert {"$limit": 5} in pipeline
+    assert _stages(pipeline).index('$limit') < _stages(pipeline).index('$lookup')
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("How many pending orders are there?", ('orders', 'count', {"status": "pending"})),
+    ("number of customers", ('customers', 'count', {})),
+    ("count of products do we have", ('products', 'count', {})),
+])
+def test_count_templates(question, expected):
+    assert _match_template(question, FULL_SCHEMA) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "total sales this year",
+    "top 5 customers by spending in Delhi",
+    "how many orders were placed in March",
+    "list recent orders",
+])
+def test_qualified_questions_go_to_the_llm(question):
+    assert _match_template(question, FULL_SCHEMA) is None
+
+
+@pytest.mark.parametrize("question, schema_fields", [
+    ("total sales", {'orders': frozenset({'amount'})}),
+    ("top 3 customers by revenue", {'orders': FULL_SCHEMA['orders'], 'customers': frozenset({'name'})}),
+    ("how many cancelled orders", {'orders': frozenset({'amount'})}),
+    ("how many payments", FULL_SCHEMA),
+])
+def test_templates_need_their_collections_and_fields(question, schema_fields):
+    assert _match_template(question, schema_fields) is None
+
+
+def test_join_template_limits_before_lookup():
+    collection, operation, pipeline = _template_query(_agent(FULL_SCHEMA), "show completed orders with customer names")
+    assert (collection, operation) == ('orders', 'aggregate')
+    assert pipeline[0] == {"$match": {"status": "completed"}}
+    assert _stages(pipeline)[:4] == ['$match', '$sort', '$limit', '$lookup']
+    assert pipeline[1] == {"$sort": {"_id": 1}}
+
+
+def test_join_template_needs_schema_support():
+    no_email = dict(FULL_SCHEMA, customers=frozenset({'name'}))
+    assert _template_query(_agent(no_email), "orders with customer names") is None
+    no_status = dict(FULL_SCHEMA, orders=frozenset({'customerId'}))
+    assert _template_query(_agent(no_status), "pending orders with customer details") is None
+    assert _template_query(_agent(no_status), "orders with customer details")[0] == 'orders'